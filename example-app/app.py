@@ -54,13 +54,11 @@ def is_number(s):
 
 @app.route('/set_rule/<name>/<value>')
 def set_rules(name, value):
-    rules = flask_change_password.rules
     if value in ['true', 'false']:
         value = value == 'true'
     elif is_number(value):
         value = int(value)
-    rules[name] = value
-    rules = flask_change_password.update_rules(rules)
+    rules = flask_change_password.update_rules({name: value})
     return jsonify(rules)
 
 
@@ -13,8 +13,9 @@
 # limitations under the License.
 
 
-from .flask_change_password import (
-    ChangePassword, ChangePasswordForm, SetPasswordForm)
+# the forms import WTForms, which is left until they are used.  The same lazy lookup serves both
+# flask_change_password.ChangePasswordForm and flask_change_password.flask_change_password.ChangePasswordForm
+from .flask_change_password import ChangePassword, __getattr__  # noqa: F401
 
 __all__ = (
     'ChangePassword', 'ChangePasswordForm', 'SetPasswordForm',
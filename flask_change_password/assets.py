@@ -0,0 +1,52 @@
+import hashlib
+import mimetypes
+import os
+
+# files in the package directory that may be served
+STATIC_ASSETS = ('pageChangePassword.js',)
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+class StaticAsset:
+    """
+    A static file read once, with its content hash and precompressed
+    gzip and brotli variants
+    """
+
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.content = f.read()
+        self.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.version = hashlib.sha256(self.content).hexdigest()[:16]
+        self.variants = {'identity': self.content}
+        # compressors are imported when the first asset is loaded, not at import time
+        import gzip
+        try:
+            import brotli
+        except ImportError:
+            brotli = None
+        # no timestamp, so every worker builds the same bytes for the same ETag
+        compressed = gzip.compress(self.content, 9, mtime=0)
+        if len(compressed) < len(self.content):
+            self.variants['gzip'] = compressed
+        if brotli is not None:
+            compressed = brotli.compress(self.content)
+            if len(compressed) < len(self.content):
+                self.variants['br'] = compressed
+
+    def etag(self, encoding):
+        return self.version if encoding == 'identity' else '{}-{}'.format(self.version, encoding)
+
+    def choose_encoding(self, accept_encodings):
+        """
+        :param accept_encodings: werkzeug Accept of the request Accept-Encoding header
+        :return: the smallest variant the client accepts
+        """
+        encodings = [encoding for encoding in ('br', 'gzip') if encoding in self.variants and
+                     accept_encodings[encoding] > 0]
+        return encodings[0] if encodings else 'identity'
+
+
+def load_assets(base_dir):
+    return dict((name, StaticAsset(os.path.join(base_dir, name))) for name in STATIC_ASSETS)
@@ -0,0 +1,169 @@
+"""
+Micro benchmarks of the password validation hot path.
+
+    python -m flask_change_password.benchmark --output bench.json
+
+Results are written as JSON so they can be compared between releases.
+"""
+import argparse
+import datetime
+import json
+import platform
+import statistics
+import sys
+import threading
+import timeit
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from flask import Flask
+
+from .flask_change_password import ChangePassword, ChangePasswordForm
+from .pwned import PwnedClient
+from .validator import normalize
+
+RULE_CONFIGURATIONS = {
+    'default': {},
+    'length_only': {'punctuation': 0, 'uppercase': 0, 'lowercase': 0, 'numbers': 0, 'username': False,
+                    'number_sequence': False, 'alphabet_sequence': False, 'keyboard_sequence': False,
+                    'passwords': False},
+    'no_normalize': {'normalize': False},
+    'min_guesses': {'min_guesses': 1e8},
+    'strict': {'punctuation': 2, 'uppercase': 2, 'lowercase': 2, 'numbers': 2, 'descending_sequences': True,
+               'long_password_override': 0},
+}
+MIN_PASSWORD_LENGTH = 10
+PASSWORDS = {
+    'short': 'Sh0rt!',
+    'minimum': 'Gq7#vKp2!x',
+    'long_override': 'Gq7#vKp2!xLm4$wRt8&zNb3^yHc6*dFs',
+    'full_width': '\uff27\uff51\uff17#\uff56\uff2b\uff50\uff12!\uff58',
+}
+
+
+class PwnedStubHandler(BaseHTTPRequestHandler):
+    """
+    local stand in for the HIBP range API
+    """
+    body = '\r\n'.join('{:035X}:{}'.format(x * 7919, x) for x in range(800)).encode()
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def measure(name, function, params=None, number=100, repeat=5):
+    """
+    :return: dict of timings in seconds per call
+    """
+    times = [total / number for total in timeit.repeat(function, number=number, repeat=repeat)]
+    return dict(name=name, params=params or {}, number=number, rounds=repeat, min=min(times),
+                max=max(times), mean=statistics.mean(times), median=statistics.median(times),
+                stdev=statistics.stdev(times) if len(times) > 1 else 0.0, ops=1 / min(times))
+
+
+def valid_password(change_password, password):
+    def run():
+        change_password.valid_password(password, username='bench.user')
+
+    return run
+
+
+def benchmark_password_good_enough(number, repeat):
+    results = []
+    for configuration, rules in sorted(RULE_CONFIGURATIONS.items()):
+        change_password = ChangePassword(min_password_length=MIN_PASSWORD_LENGTH, rules=dict(rules, pwned='off'))
+        change_password.get_common_passwords()
+        for length, password in sorted(PASSWORDS.items()):
+            results.append(measure('password_good_enough', valid_password(change_password, password),
+                                   dict(rules=configuration, password=length), number, repeat))
+    return results
+
+
+def benchmark_checks(number, repeat):
+    change_password = ChangePassword(min_password_length=MIN_PASSWORD_LENGTH)
+    validator = change_password.validator
+    estimator = change_password.estimator
+    common_passwords = validator.common_passwords()
+    results = []
+    for length, password in sorted(PASSWORDS.items()):
+        lower_password = password.lower()
+        results.append(measure('normalize', lambda: normalize(password), dict(password=length), number, repeat))
+        results.append(measure('estimate_strength', lambda: estimator.estimate(password), dict(password=length),
+                               number, repeat))
+        results.append(measure('common_passwords', lambda: common_passwords.find(password),
+                               dict(password=length), number, repeat))
+        for rule in ['number_sequences', 'alphabet_sequences', 'keyboard_sequences']:
+            scanner = getattr(validator, rule)
+            results.append(measure(rule, lambda: scanner.find(lower_password), dict(password=length), number, repeat))
+    return results
+
+
+def benchmark_check_pwned(number, repeat):
+    server = HTTPServer(('127.0.0.1', 0), PwnedStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = PwnedClient(url='http://127.0.0.1:{}/'.format(server.server_address[1]))
+        change_password = ChangePassword(min_password_length=0, pwned_client=client)
+        password = PASSWORDS['minimum']
+
+        def uncached():
+            client.clear()
+            change_password.check_pwned(password)
+
+        return [measure('check_pwned', uncached, dict(cache='miss'), max(1, number // 10), repeat),
+                measure('check_pwned', lambda: change_password.check_pwned(password), dict(cache='hit'), number,
+                        repeat)]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def benchmark_template(number, repeat):
+    app = Flask(__name__)
+    app.config['WTF_CSRF_ENABLED'] = False
+    change_password = ChangePassword(app=app, min_password_length=MIN_PASSWORD_LENGTH)
+    with app.test_request_context('/change_password'):
+        form = ChangePasswordForm(username='bench.user', changing=True, title='Change Password')
+        change_password.change_password_template(form)
+        return [measure('change_password_template', lambda: change_password.change_password_template(form),
+                        {}, number, repeat)]
+
+
+BENCHMARKS = [benchmark_password_good_enough, benchmark_checks, benchmark_check_pwned, benchmark_template]
+
+
+def run(number=1000, repeat=5):
+    """
+    :return: dict of machine information and benchmark results
+    """
+    results = []
+    for benchmark in BENCHMARKS:
+        results.extend(benchmark(number, repeat))
+    return dict(datetime=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                machine_info=dict(python=platform.python_version(), implementation=platform.python_implementation(),
+                                  platform=platform.platform()),
+                benchmarks=results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=1000, help='calls per round')
+    parser.add_argument('--repeat', type=int, default=5, help='rounds')
+    parser.add_argument('--output', help='write JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+    results = run(args.number, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
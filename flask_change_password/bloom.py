@@ -0,0 +1,122 @@
+import math
+import mmap
+import os
+import struct
+
+from .pwned import parse_pwned_line, sha1_digest
+
+MAGIC = b'FCPBLOOM'
+HEADER_FORMAT = '>8sQQQd'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+class BloomFilter:
+    """
+    Bloom filter of SHA-1 digests.  A negative answer means the digest was
+    never added, a positive answer is wrong at most error_rate of the time.
+    The bit positions come from the digest itself by double hashing, so no
+    further hashing is needed.
+    """
+
+    def __init__(self, capacity, error_rate=0.001, bits=None, hash_count=None, count=0, data=None):
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.bits = bits or max(8, int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hash_count = hash_count or max(1, int(round(self.bits / self.capacity * math.log(2))))
+        self.count = count
+        self.data = data if data is not None else bytearray((self.bits + 7) // 8)
+        self.lookups = 0
+        self.negatives = 0
+
+    def _positions(self, digest):
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hash_count)]
+
+    def add(self, digest):
+        data = self.data
+        for position in self._positions(digest):
+            data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        self.lookups += 1
+        data = self.data
+        for position in self._positions(digest):
+            if not data[position >> 3] & (1 << (position & 7)):
+                self.negatives += 1
+                return False
+        return True
+
+    def might_be_pwned(self, password):
+        return sha1_digest(password) in self
+
+    def size(self):
+        """
+        :return: bytes used by the bit array
+        """
+        return len(self.data)
+
+    def stats(self):
+        return dict(bytes=self.size(), bits=self.bits, hash_count=self.hash_count, count=self.count,
+                    capacity=self.capacity, error_rate=self.error_rate, lookups=self.lookups,
+                    negatives=self.negatives)
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(struct.pack(HEADER_FORMAT, MAGIC, self.capacity, self.bits, self.hash_count, self.error_rate))
+            f.write(struct.pack('>Q', self.count))
+            f.write(self.data)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        memory map a filter written by save
+        """
+        with open(filename, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, capacity, bits, hash_count, error_rate = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+        if magic != MAGIC:
+            raise ValueError('{} is not a bloom filter'.format(filename))
+        count = struct.unpack('>Q', data[HEADER_SIZE:HEADER_SIZE + 8])[0]
+        view = memoryview(data)[HEADER_SIZE + 8:]
+        return cls(capacity, error_rate, bits=bits, hash_count=hash_count, count=count, data=view)
+
+
+def build_bloom_filter(source_filename, filename, error_rate=0.001, capacity=None, min_count=0):
+    """
+    stream a HIBP 'SHA1:count' text dump into a bloom filter file
+    :param source_filename: text dump, one SHA1:count per line
+    :param filename: filter file to write
+    :param error_rate: target false positive rate
+    :param capacity: expected number of hashes, counted from the dump when not given
+    :param min_count: skip hashes seen fewer than this many times
+    :return: BloomFilter
+    """
+    if capacity is None:
+        with open(source_filename) as source:
+            capacity = sum(1 for line in source if line.strip())
+    bloom_filter = BloomFilter(capacity, error_rate)
+    with open(source_filename) as source:
+        for line in source:
+            record = parse_pwned_line(line)
+            if record is not None and record[1] >= min_count:
+                bloom_filter.add(record[0])
+    bloom_filter.save(filename)
+    return bloom_filter
+
+
+def benchmark_bloom_filter(bloom_filter, samples=100000):
+    """
+    measure the share of random lookups answered by the filter alone
+    :return: dict of filter statistics
+    """
+    negatives = bloom_filter.negatives
+    for _ in range(samples):
+        os.urandom(20) in bloom_filter
+    stats = bloom_filter.stats()
+    stats.update(samples=samples, answered_by_filter=(bloom_filter.negatives - negatives) / float(samples or 1))
+    return stats
@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Stops calling a service that is failing.  While closed every call is
+    counted in a sliding window of window seconds, and once at least min_calls
+    were made and error_rate of them failed the breaker opens.  While open
+    calls are refused, then after reset_timeout seconds it is half open and
+    lets one probe call through: success closes it, failure opens it again.
+    Calls slower than latency_budget seconds count as failures.
+    """
+
+    def __init__(self, error_rate=0.5, min_calls=10, window=30.0, reset_timeout=30.0, latency_budget=0):
+        """
+        :param error_rate: fraction of failed calls in the window that opens the breaker
+        :param min_calls: calls in the window before the error rate is acted on
+        :param window: seconds of calls counted
+        :param reset_timeout: seconds open before a probe call is let through
+        :param latency_budget: seconds a call may take before it counts as failed, 0 for no budget
+        """
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.reset_timeout = reset_timeout
+        self.latency_budget = latency_budget
+        self.state = CLOSED
+        self.opens = 0
+        self.refused = 0
+        self._calls = deque()
+        self._failures = 0
+        self._opened = 0.0
+        self._probing = 0.0
+        self._lock = threading.Lock()
+
+    def stats(self):
+        return dict(open=int(self.state == OPEN), half_open=int(self.state == HALF_OPEN), opens=self.opens,
+                    refused=self.refused)
+
+    def allow(self):
+        """
+        :return: True when a call may be made now
+        """
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = 0.0
+            # one probe at a time, another if the last has not answered within reset_timeout
+            if self.state == HALF_OPEN and (not self._probing or now - self._probing >= self.reset_timeout):
+                self._probing = now
+                return True
+            if self.state == CLOSED:
+                return True
+            self.refused += 1
+            return False
+
+    def record(self, ok, seconds=0.0):
+        """
+        record the outcome of a call
+        :param ok: False when the call failed
+        :param seconds: time the call took
+        """
+        failed = not ok or 0 < self.latency_budget < seconds
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self._close()
+                return
+            if self.state == OPEN:
+                return
+            self._calls.append((now, failed))
+            self._failures += failed
+            while now - self._calls[0][0] > self.window:
+                self._failures -= self._calls.popleft()[1]
+            if len(self._calls) >= self.min_calls and self._failures >= self.error_rate * len(self._calls):
+                self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opens += 1
+        self._opened = now
+        self._calls.clear()
+        self._failures = 0
+
+    def _close(self):
+        self.state = CLOSED
+        self._probing = 0.0
+        self._calls.clear()
+        self._failures = 0
@@ -0,0 +1,61 @@
+import json
+
+import click
+from flask.cli import AppGroup
+
+from .bloom import BloomFilter, benchmark_bloom_filter, build_bloom_filter
+from .common_passwords import COMMON_PASSWORDS_FILE, build_password_matcher
+from .dictionary import build_dictionary
+from .pwned import build_pwned_index
+
+change_password_cli = AppGroup('change-password', help='Build and inspect flask-change-password data files.')
+
+
+@change_password_cli.command('build-pwned-index')
+@click.argument('source')
+@click.argument('index')
+@click.option('--min-count', default=0, help='Skip hashes seen fewer than this many times.')
+def build_pwned_index_command(source, index, min_count):
+    """Build a local pwned INDEX from a HIBP SHA1:count SOURCE dump."""
+    written = build_pwned_index(source, index, min_count=min_count)
+    click.echo('{} hashes written to {}'.format(written, index))
+
+
+@change_password_cli.command('build-common-passwords')
+@click.argument('target')
+@click.option('--source', default=None, help='Password list, one per line.  The shipped list when not given.')
+def build_common_passwords_command(target, source):
+    """Compile the common password list into TARGET, memory mapped by every worker with the passwords_index rule."""
+    written = build_password_matcher(source or COMMON_PASSWORDS_FILE, target)
+    click.echo('{} passwords written to {}'.format(written, target))
+
+
+@change_password_cli.command('build-dictionary')
+@click.argument('source')
+@click.argument('target')
+@click.option('--min-length', default=3, help='Skip words shorter than this.')
+@click.option('--chunk-size', default=1000000, help='Words sorted in memory at a time.')
+def build_dictionary_command(source, target, min_length, chunk_size):
+    """Build a dictionary index TARGET from a SOURCE word list of any size, one password per line."""
+    written = build_dictionary(source, target, min_length=min_length, chunk_size=chunk_size)
+    click.echo('{} words written to {}'.format(written, target))
+
+
+@change_password_cli.command('build-bloom')
+@click.argument('source')
+@click.argument('target')
+@click.option('--error-rate', default=0.001, help='Target false positive rate.')
+@click.option('--capacity', type=int, default=None, help='Expected number of hashes.  Counted when not given.')
+@click.option('--min-count', default=0, help='Skip hashes seen fewer than this many times.')
+def build_bloom_command(source, target, error_rate, capacity, min_count):
+    """Build a pwned bloom filter TARGET from a HIBP SHA1:count SOURCE dump."""
+    bloom_filter = build_bloom_filter(source, target, error_rate=error_rate, capacity=capacity, min_count=min_count)
+    click.echo('{} hashes, {} bytes written to {}'.format(bloom_filter.count, bloom_filter.size(), target))
+
+
+@change_password_cli.command('bench-bloom')
+@click.argument('filename')
+@click.option('--samples', default=100000, help='Number of random lookups.')
+def bench_bloom_command(filename, samples):
+    """Report the memory footprint of bloom filter FILENAME and the share of lookups it answers alone."""
+    click.echo(json.dumps(benchmark_bloom_filter(BloomFilter.load(filename), samples=samples), indent=2))
@@ -0,0 +1,298 @@
+import bisect
+import mmap
+import os
+from array import array
+from collections import deque
+
+MAGIC = b'FCPWORDS'
+# byte order marker, the file is written in native byte order for zero copy access
+BYTE_ORDER_MARK = 0x01020304
+VERSION = 1
+HEADER_WORDS = 8
+WORD_SIZE = 4
+# the list shipped with the package
+COMMON_PASSWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                     '10_million_password_list_top_10000.txt')
+
+
+class CommonPasswordMatcher:
+    """
+    Aho-Corasick automaton over a list of known passwords.
+
+    A candidate password is too similar to a known password when it starts
+    with it, or when it contains it and the known password is more than half
+    the length of the candidate.  All known passwords found in the candidate
+    are reported by a single pass over the candidate, so the cost of a check
+    does not grow with the size of the list.
+    """
+
+    def __init__(self, known_passwords):
+        self.known_passwords = []
+        # goto transitions, failure links and the (index, length) outputs of each node
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for known_password in known_passwords:
+            known_password = known_password.strip()
+            if known_password:
+                self._add(known_password, len(self.known_passwords))
+                self.known_passwords.append(known_password)
+        self._build_failure_links()
+
+    @classmethod
+    def from_file(cls, filename):
+        with open(filename) as f:
+            return cls(f)
+
+    def __len__(self):
+        return len(self.known_passwords)
+
+    def save(self, filename):
+        """
+        write the automaton as flat arrays that MappedPasswordMatcher memory maps
+        """
+        edge_start, edge_chars, edge_targets = [0], [], []
+        output_start, output_index, output_length = [0], [], []
+        for goto, outputs in zip(self._goto, self._output):
+            for c, next_node in sorted(goto.items()):
+                edge_chars.append(ord(c))
+                edge_targets.append(next_node)
+            edge_start.append(len(edge_chars))
+            for index, length in outputs:
+                output_index.append(index)
+                output_length.append(length)
+            output_start.append(len(output_index))
+        encoded = [known_password.encode('utf-8') for known_password in self.known_passwords]
+        password_offsets = [0]
+        for known_password in encoded:
+            password_offsets.append(password_offsets[-1] + len(known_password))
+        header = [BYTE_ORDER_MARK, VERSION, len(self._goto), len(edge_chars), len(output_index),
+                  len(encoded), password_offsets[-1], 0]
+        with open(filename, 'wb') as f:
+            f.write(MAGIC)
+            for section in [header, edge_start, self._fail, output_start, edge_chars, edge_targets, output_index,
+                            output_length, password_offsets]:
+                f.write(_words(section).tobytes())
+            f.write(b''.join(encoded))
+
+    def _add(self, known_password, index):
+        node = 0
+        for c in known_password:
+            next_node = self._goto[node].get(c)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][c] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = next_node
+        if not self._output[node]:
+            self._output[node] = ((index, len(known_password)),)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, next_node in self._goto[node].items():
+                queue.append(next_node)
+                fail = self._fail[node]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_node] = self._goto[fail].get(c, 0)
+                self._output[next_node] = self._output[next_node] + self._output[self._fail[next_node]]
+
+    def find(self, password):
+        """
+        find the first known password, in list order, that the password is too
+        similar to
+        :param password:
+        :return: the known password or None
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        password_length = len(password)
+        best = None
+        node = 0
+        for position, c in enumerate(password):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            for index, length in output[node]:
+                if best is not None and index >= best:
+                    continue
+                # starts with the known password or contains a long enough one
+                if position + 1 == length or length * 2 > password_length:
+                    best = index
+        if best is None:
+            return None
+        return self.known_passwords[best]
+
+    def matches(self, password):
+        """
+        every known password in the password, in a single pass.  The list is
+        ordered by frequency so the index is the rank of the password.
+        :return: generator of (start, end, index) with end inclusive
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        node = 0
+        for position, c in enumerate(password):
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            for index, length in output[node]:
+                yield position - length + 1, position, index
+
+
+def _words(values):
+    words = array('I', values)
+    if words.itemsize != WORD_SIZE:
+        words = array('L', values)
+    return words
+
+
+def build_password_matcher(source_filename, filename):
+    """
+    compile a word list, one password per line, into a file for MappedPasswordMatcher
+    :return: number of passwords written
+    """
+    matcher = CommonPasswordMatcher.from_file(source_filename)
+    matcher.save(filename)
+    return len(matcher)
+
+
+class MappedPasswordMatcher:
+    """
+    CommonPasswordMatcher read from a file written by save.  The automaton is
+    memory mapped read only rather than rebuilt as Python objects, so every
+    process using the file shares one copy of its pages through the page
+    cache, and opening it costs no more than the header.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._open()
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self):
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError('{} is not a compiled password list'.format(self.filename))
+        self._view = memoryview(self._map)
+        header = self._view[len(MAGIC):len(MAGIC) + HEADER_WORDS * WORD_SIZE].cast('I')
+        if header[0] != BYTE_ORDER_MARK or header[1] != VERSION:
+            header.release()
+            raise ValueError('{} was compiled for another platform or version, rebuild it'.format(self.filename))
+        nodes, edges, outputs, passwords, blob_size = header[2:7]
+        header.release()
+        sizes = [nodes + 1, nodes, nodes + 1, edges, edges, outputs, outputs, passwords + 1]
+        start = len(MAGIC) + HEADER_WORDS * WORD_SIZE
+        end = start + sum(sizes) * WORD_SIZE
+        if len(self._map) != end + blob_size:
+            raise ValueError('{} is truncated'.format(self.filename))
+        self._words = self._view[start:end].cast('I')
+        sections = []
+        offset = 0
+        for size in sizes:
+            sections.append(self._words[offset:offset + size])
+            offset += size
+        (self._edge_start, self._fail, self._output_start, self._edge_chars, self._edge_targets,
+         self._output_index, self._output_length, self._password_offsets) = sections
+        self._blob = self._view[end:]
+        self.passwords = passwords
+        # most steps fall back to the root, its few transitions are kept as a dict
+        self._root = dict((chr(self._edge_chars[edge]), self._edge_targets[edge])
+                          for edge in range(self._edge_start[0], self._edge_start[1]))
+
+    def __len__(self):
+        return self.passwords
+
+    def close(self):
+        for name in ['_edge_start', '_fail', '_output_start', '_edge_chars', '_edge_targets', '_output_index',
+                     '_output_length', '_password_offsets', '_blob', '_words', '_view']:
+            view = self.__dict__.pop(name, None)
+            if view is not None:
+                view.release()
+        self._map.close()
+
+    def known_password(self, index):
+        offsets = self._password_offsets
+        return bytes(self._blob[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+    def find(self, password):
+        """
+        find the first known password, in list order, that the password is too
+        similar to
+        :param password:
+        :return: the known password or None
+        """
+        edge_start = self._edge_start
+        edge_chars = self._edge_chars
+        edge_targets = self._edge_targets
+        fail = self._fail
+        output_start = self._output_start
+        output_index = self._output_index
+        output_length = self._output_length
+        root = self._root
+        bisect_left = bisect.bisect_left
+        password_length = len(password)
+        best = None
+        node = 0
+        for position, c in enumerate(password):
+            code = ord(c)
+            while True:
+                if not node:
+                    node = root.get(c, 0)
+                    break
+                low = edge_start[node]
+                high = edge_start[node + 1]
+                edge = bisect_left(edge_chars, code, low, high)
+                if edge < high and edge_chars[edge] == code:
+                    node = edge_targets[edge]
+                    break
+                node = fail[node]
+            for output in range(output_start[node], output_start[node + 1]):
+                index = output_index[output]
+                if best is not None and index >= best:
+                    continue
+                # starts with the known password or contains a long enough one
+                length = output_length[output]
+                if position + 1 == length or length * 2 > password_length:
+                    best = index
+        if best is None:
+            return None
+        return self.known_password(best)
+
+    def matches(self, password):
+        """
+        every known password in the password, see CommonPasswordMatcher.matches
+        :return: generator of (start, end, index) with end inclusive
+        """
+        edge_start = self._edge_start
+        edge_chars = self._edge_chars
+        edge_targets = self._edge_targets
+        fail = self._fail
+        output_start = self._output_start
+        root = self._root
+        node = 0
+        for position, c in enumerate(password):
+            code = ord(c)
+            while True:
+                if not node:
+                    node = root.get(c, 0)
+                    break
+                low = edge_start[node]
+                high = edge_start[node + 1]
+                edge = bisect.bisect_left(edge_chars, code, low, high)
+                if edge < high and edge_chars[edge] == code:
+                    node = edge_targets[edge]
+                    break
+                node = fail[node]
+            for output in range(output_start[node], output_start[node + 1]):
+                yield position - self._output_length[output] + 1, position, self._output_index[output]
@@ -0,0 +1,235 @@
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = b'FCPDICT1'
+HEADER_FORMAT = '>8sQQQQ'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+OFFSET_FORMAT = '>Q'
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+# first words of at most this many evenly spaced blocks are kept in memory to start each search
+SAMPLES = 1024
+
+
+def _varint(value):
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def _read_varint(data, position):
+    """
+    :return: (value, position after it)
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
+
+def _shared_length(a, b):
+    length = min(len(a), len(b))
+    for x in range(length):
+        if a[x] != b[x]:
+            return x
+    return length
+
+
+def _read_run(filename):
+    with open(filename, 'rb') as f:
+        for line in f:
+            yield line[:-1]
+
+
+def _write_run(chunk, directory):
+    chunk.sort()
+    fd, filename = tempfile.mkstemp(suffix='.dictionary-run', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        for word in chunk:
+            f.write(word + b'\n')
+    return filename
+
+
+def build_dictionary(source_filename, filename, min_length=3, chunk_size=1000000, block_size=16):
+    """
+    stream a word list, one password per line, into a sorted, front coded
+    index for DictionaryIndex.  The list is sorted in chunks of chunk_size
+    words which are then merged, so it is never held in memory all at once.
+    :param source_filename: word list in UTF-8
+    :param filename: index to write
+    :param min_length: skip words shorter than this, short words would match too many passwords
+    :param chunk_size: words sorted in memory at a time
+    :param block_size: words per block, each block stores its first word in full and the rest as suffixes
+    :return: number of words written
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    run_filenames = []
+    try:
+        with open(source_filename, encoding='utf-8', errors='replace') as source:
+            chunk = []
+            for line in source:
+                word = line.strip()
+                if len(word) < min_length:
+                    continue
+                chunk.append(word.encode('utf-8'))
+                if len(chunk) >= chunk_size:
+                    run_filenames.append(_write_run(chunk, directory))
+                    chunk = []
+            if chunk or not run_filenames:
+                run_filenames.append(_write_run(chunk, directory))
+
+        written = 0
+        offsets = []
+        previous = None
+        with open(filename, 'wb') as index:
+            index.write(b'\0' * HEADER_SIZE)
+            position = HEADER_SIZE
+            for word in heapq.merge(*[_read_run(run_filename) for run_filename in run_filenames]):
+                if word == previous:
+                    continue
+                if written % block_size == 0:
+                    offsets.append(position)
+                    record = _varint(len(word)) + word
+                else:
+                    shared = _shared_length(previous, word)
+                    record = _varint(shared) + _varint(len(word) - shared) + word[shared:]
+                index.write(record)
+                position += len(record)
+                previous = word
+                written += 1
+            for offset in offsets:
+                index.write(struct.pack(OFFSET_FORMAT, offset))
+            index.seek(0)
+            index.write(struct.pack(HEADER_FORMAT, MAGIC, written, len(offsets), block_size, position))
+        return written
+    finally:
+        for run_filename in run_filenames:
+            os.remove(run_filename)
+
+
+class DictionaryIndex:
+    """
+    Memory mapped, sorted and front coded word list built by build_dictionary.
+    Words are found by a binary search over the first word of each block and
+    a scan of at most one block, so a lookup costs O(log n) whatever the size
+    of the list, and every process using the file shares its pages.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER_SIZE:
+                raise ValueError('{} is not a dictionary index'.format(filename))
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.words, self.blocks, self.block_size, self._offsets = struct.unpack(
+            HEADER_FORMAT, self._map[:HEADER_SIZE])
+        if magic != MAGIC or size != self._offsets + self.blocks * OFFSET_SIZE:
+            self._map.close()
+            raise ValueError('{} is not a dictionary index'.format(filename))
+        self._stride = max(1, -(-self.blocks // SAMPLES))
+        self._samples = None
+
+    def __len__(self):
+        return self.words
+
+    def close(self):
+        self._map.close()
+
+    def _block_offset(self, block):
+        return struct.unpack_from(OFFSET_FORMAT, self._map, self._offsets + block * OFFSET_SIZE)[0]
+
+    def _first_word(self, block):
+        length, position = _read_varint(self._map, self._block_offset(block))
+        return self._map[position:position + length]
+
+    def _words(self, block):
+        """
+        :return: generator of the words in a block, in order
+        """
+        data = self._map
+        length, position = _read_varint(data, self._block_offset(block))
+        word = data[position:position + length]
+        position += length
+        yield word
+        end = self._block_offset(block + 1) if block + 1 < self.blocks else self._offsets
+        while position < end:
+            shared, position = _read_varint(data, position)
+            length, position = _read_varint(data, position)
+            word = word[:shared] + data[position:position + length]
+            position += length
+            yield word
+
+    def _floor(self, key):
+        """
+        :param key: bytes
+        :return: the last word <= key or None when there is none
+        """
+        if self._samples is None:
+            self._samples = [self._first_word(block) for block in range(0, self.blocks, self._stride)]
+        # last block whose first word is <= key, narrowed by the samples then searched in the file
+        low = max(0, bisect.bisect_right(self._samples, key) - 1) * self._stride
+        high = min(low + self._stride, self.blocks)
+        while high - low > 1:
+            middle = (low + high) // 2
+            if self._first_word(middle) <= key:
+                low = middle
+            else:
+                high = middle
+        floor = None
+        for word in self._words(low):
+            if word > key:
+                break
+            floor = word
+        return floor
+
+    def __contains__(self, word):
+        if not self.words:
+            return False
+        key = word.encode('utf-8')
+        return self._floor(key) == key
+
+    def find(self, password):
+        """
+        find the longest word that the password is too similar to.  As with
+        CommonPasswordMatcher, the password is too similar when it starts with
+        the word, or contains it and the word is more than half its length.
+        :param password:
+        :return: the word or None
+        """
+        if not self.words:
+            return None
+        encoded = password.encode('utf-8')
+        password_length = len(password)
+        best = None
+        for start in range(len(encoded)):
+            key = encoded[start:]
+            # past the start a word must be more than half the password, and it is no shorter in bytes
+            shortest = 1 if start == 0 else password_length // 2 + 1
+            while len(key) >= shortest and (best is None or len(key) > len(best)):
+                # the last word <= key is the longest word key starts with, if
+                # it starts with one at all.  When it is not, no word longer
+                # than their common prefix can be either, so search again for that.
+                floor = self._floor(key)
+                if floor is None:
+                    break
+                if key.startswith(floor):
+                    if (best is None or len(floor) > len(best)) and (
+                            start == 0 or len(floor.decode('utf-8')) * 2 > password_length):
+                        best = floor
+                    break
+                key = key[:_shared_length(floor, key)]
+        if best is None:
+            return None
+        return best.decode('utf-8')
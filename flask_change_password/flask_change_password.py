@@ -1,28 +1,80 @@
-import os
 import hashlib
-import string
-import re
-import requests
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+import weakref
+
+from flask import request, flash, render_template, jsonify, current_app, url_for, abort, session
+
+from .assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, load_assets
+from .bloom import BloomFilter
+from .common_passwords import COMMON_PASSWORDS_FILE, CommonPasswordMatcher, MappedPasswordMatcher
+from .dictionary import DictionaryIndex
+from .profiles import DEFAULT_PROFILE, RuleProfile, freeze_rules
+from .pwned import LocalPwnedIndex, PwnedClient, PwnedUnavailable, sha1_digest
+# re-exported, PWNED_URL was defined in this module before the pwned client moved to pwned.py
+from .pwned import PWNED_URL  # noqa: F401
+from .validator import USERNAME_RE, ValidationResult, plural
+
+logger = logging.getLogger(__name__)
+
+# imported on first use, WTForms is only needed by applications rendering the forms
+LAZY_FORMS = ('ChangePasswordForm', 'SetPasswordForm')
+
+
+def __getattr__(name):
+    if name in LAZY_FORMS:
+        from . import forms
+        return getattr(forms, name)
+    raise AttributeError('module has no attribute {!r}'.format(name))
+
+
+# rules validator of a validate_many worker process
+_worker_change_password = None
+
 
-from flask import request, flash, send_from_directory, render_template_string, jsonify
-from flask_wtf import FlaskForm
-from wtforms import PasswordField, SubmitField, HiddenField
-from wtforms.validators import DataRequired, EqualTo
+def _init_worker(rules):
+    global _worker_change_password
+    _worker_change_password = ChangePassword(rules=dict(rules, pwned='off'))
 
-PWNED_URL = 'https://api.pwnedpasswords.com/'
+
+def _worker_rules_scores(items):
+    return [_worker_change_password.valid_password(password, username) for password, username in items]
 
 
 class ChangePassword:
-    def __init__(self, app=None, min_password_length=20, rules=None):
+    def __init__(self, app=None, min_password_length=20, rules=None, pwned_client=None, result_cache=None,
+                 metrics=None):
         self.base_dir = os.path.dirname(__file__)
-        self.min_password_length = min_password_length
         self.app = None
-        self.rules = {'punctuation': 1, 'uppercase': 1, 'lowercase': 1, 'number_sequence': True,
-                      'username': True, 'numbers': 1, 'username_length': 0, 'username_requires_separators': False,
-                      'passwords': True, 'keyboard_sequence': True, 'alphabet_sequence': True,
-                      'long_password_override': 2, 'pwned': True, 'show_hide_passwords': True, 'flash': True}
-        self.update_rules(dict(min_password_length=min_password_length))
-        self.update_rules(rules or {})
+        self.pwned_client = pwned_client or PwnedClient()
+        self.result_cache = result_cache
+        self.rate_limiter = None
+        self.metrics = metrics
+        self.bulk_limit = 0
+        self.live_url = ''
+        self.templates = weakref.WeakKeyDictionary()
+        self.assets = None
+        # files loaded for the rules of any profile, by (kind, file name)
+        self.resources = {}
+        self.versions = itertools.count(1)
+        self.lock = threading.RLock()
+        default_rules = {'punctuation': 1, 'uppercase': 1, 'lowercase': 1, 'number_sequence': True,
+                         'username': True, 'numbers': 1, 'username_length': 0, 'username_requires_separators': False,
+                         'passwords': True, 'passwords_index': '', 'dictionaries': [], 'keyboard_sequence': True,
+                         'alphabet_sequence': True, 'number_sequence_length': 3, 'alphabet_sequence_length': 4,
+                         'keyboard_sequence_length': 4, 'keyboard_layouts': ['qwerty', 'qwertz', 'azerty', 'numpad'],
+                         'descending_sequences': False, 'normalize': True, 'min_guesses': 0,
+                         'long_password_override': 2, 'pwned': True, 'pwned_index': '', 'pwned_min_count': 0,
+                         'pwned_failure': 'closed', 'pwned_bloom': '', 'show_hide_passwords': True, 'flash': True,
+                         'check_password_debounce': 300}
+        default_rules['min_password_length'] = min_password_length
+        default_rules.update(rules or {})
+        # name to RuleProfile, replaced as a whole on every change so reads need no lock
+        self.profiles = {DEFAULT_PROFILE: self.compile_profile(DEFAULT_PROFILE, default_rules)}
 
         self.messages = dict(too_short='User name too short.  {} required',
                              invalid_username='Invalid user name',
@@ -33,105 +85,578 @@ class ChangePassword:
         if app:
             self.init_app(app)
 
-    def init_app(self, app):
+    def init_app(self, app, use_async=False, bulk_limit=0, rate_limiter=None, metrics_route=False, warmup=False,
+                 live=False):
+        """
+        :param app: Flask application
+        :param use_async: serve check_password with the asyncio validation path as Flask async views, requires
+            asgiref
+        :param bulk_limit: when more than 0 serve check_passwords for up to this many passwords per request
+        :param rate_limiter: RateLimiter applied per client IP address and session to the check routes
+        :param metrics_route: serve the metrics in Prometheus text format from /flask_change_password/metrics
+        :param warmup: load everything the first request would, see warmup
+        :param live: serve the live check WebSocket channel, requires flask-sock
+        """
         self.app = app
-        self.app.route('/flask_change_password/check_password', methods=['POST'])(self.route_check_password)
+        self.bulk_limit = bulk_limit
+        self.rate_limiter = rate_limiter
+        check_password = self.route_check_password_async if use_async else self.route_check_password
+        self.app.route('/flask_change_password/check_password', methods=['POST'],
+                       endpoint='route_check_password')(check_password)
+        validate_password = self.route_validate_password_async if use_async else self.route_validate_password
+        self.app.route('/flask_change_password/validate_password', methods=['POST'],
+                       endpoint='route_validate_password')(validate_password)
+        if bulk_limit > 0:
+            if rate_limiter is not None and bulk_limit > rate_limiter.burst:
+                raise ValueError('bulk_limit cannot be more than the rate_limiter burst, a request costs a token '
+                                 'per password')
+            self.app.route('/flask_change_password/check_passwords', methods=['POST'])(self.route_check_passwords)
+        if live:
+            if use_async:
+                raise ValueError('live checks need a WSGI server, they cannot be combined with use_async')
+            from flask_sock import Sock
+
+            from .live import LIVE_PATH
+
+            Sock(self.app).route(LIVE_PATH)(self.route_live)
+            self.live_url = LIVE_PATH
+        if metrics_route:
+            if self.metrics is None:
+                raise ValueError('metrics_route requires ChangePassword metrics')
+            self.app.route('/flask_change_password/metrics', methods=['GET'])(self.route_metrics)
+        if hasattr(self.app, 'cli'):
+            from .cli import change_password_cli
+            self.app.cli.add_command(change_password_cli)
         self.app.route('/flask_change_password/static/<filename>', methods=['GET'])(self.route_change_password_static)
         self.app.route('/flask_change_password/get_rules', methods=['GET'])(self.route_get_rules)
+        if warmup:
+            self.warmup()
+
+    def warmup(self):
+        """
+        do the one time work of the first request now: open the pwned
+        session, load the common passwords, dictionaries, pwned index, bloom
+        filter of every profile and the static files and import the forms
+        """
+        from . import forms  # noqa: F401
+
+        for profile in self.profiles.values():
+            if profile.pwned_mode == 'remote':
+                self.pwned_client.get_session()
+            if profile.rules['passwords'] or profile.rules['min_guesses']:
+                self.get_common_passwords(profile)
+            if profile.pwned_mode == 'local':
+                self.get_pwned_index(profile)
+            self.get_dictionaries(profile)
+            self.get_pwned_bloom(profile)
+        self.get_assets()
+
+    def get_rules_json(self, profile=None):
+        """
+        the rules serialized once per update_rules
+        :param profile: profile name, default is the default profile
+        :return: (json, html safe json, etag)
+        """
+        return self.get_profile(profile).rules_json
+
+    def route_metrics(self):
+        gauges = dict(('pwned_{}'.format(name), value) for name, value in self.pwned_client.stats().items())
+        if self.result_cache is not None:
+            gauges.update(('result_cache_{}'.format(name), value) for name, value in self.result_cache.stats().items())
+        if self.pwned_bloom is not None:
+            gauges.update(('pwned_bloom_{}'.format(name), value) for name, value in self.pwned_bloom.stats().items())
+        if self.rate_limiter is not None:
+            gauges['rate_limited'] = self.rate_limiter.limited
+        return current_app.response_class(self.metrics.prometheus_text(gauges),
+                                          mimetype='text/plain; version=0.0.4')
+
+    def count_request(self, endpoint):
+        if self.metrics is not None:
+            self.metrics.request(endpoint)
 
     def route_get_rules(self):
-        return jsonify(self.rules)
+        self.count_request('get_rules')
+        body, html_safe, etag = self.request_profile(request.args.get('profile')).rules_json
+        response = current_app.response_class(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+        return response.make_conditional(request)
+
+    def update_rules(self, rules=None, profile=None):
+        """
+        copy the rules of a profile, with changes, into a new profile that
+        replaces it.  Validations already running keep the rules they started with.
+        :param rules: dict of rules to change
+        :param profile: profile name, default is the default profile.  A new
+            name starts from a copy of the default profile rules.
+        :return: the new rules, read only
+        """
+        name = profile or DEFAULT_PROFILE
+        with self.lock:
+            old = self.profiles.get(name)
+            new_rules = dict((old or self.profiles[DEFAULT_PROFILE]).rules)
+            new_rules.update(rules or {})
+            compiled = self.compile_profile(name, new_rules)
+            profiles = dict(self.profiles)
+            profiles[name] = compiled
+            self.profiles = profiles
+            self.prune_resources()
+            self.templates.clear()
+        return compiled.rules
+
+    def remove_profile(self, profile):
+        """
+        :param profile: name of a profile other than the default profile
+        """
+        if profile == DEFAULT_PROFILE:
+            raise ValueError('the default profile cannot be removed')
+        with self.lock:
+            profiles = dict(self.profiles)
+            del profiles[profile]
+            self.profiles = profiles
+            self.prune_resources()
+
+    def compile_profile(self, name, rules):
+        """
+        :return: RuleProfile of the rules, loading its files from the shared resources
+        """
+        # frozen first, so the loaders never see a later change to a list the caller passed
+        rules = freeze_rules(rules)
+        return RuleProfile(name, rules, next(self.versions),
+                           lambda: self.load_common_passwords(rules['passwords_index']),
+                           lambda: self.load_dictionaries(rules['dictionaries']))
 
-    def update_rules(self, rules=None):
-        self.rules.update(rules or {})
-        self.min_password_length = self.rules['min_password_length']
-        return self.rules
+    def get_profile(self, profile=None):
+        """
+        :param profile: profile name or RuleProfile, default is the default profile
+        :return: RuleProfile
+        """
+        if isinstance(profile, RuleProfile):
+            return profile
+        try:
+            return self.profiles[profile or DEFAULT_PROFILE]
+        except KeyError:
+            raise ValueError('unknown rule profile {}'.format(profile)) from None
 
-    def change_password_template(self, form, submit_text=''):
-        with open(os.path.join(self.base_dir, 'change_password_template.html')) as f:
-            text = f.read()
-        return render_template_string(text, form=form, rules_text=self.get_rules_text(), submit_text=submit_text)
+    def request_profile(self, profile):
+        """
+        :param profile: profile name sent by the client
+        :return: RuleProfile, aborting with 404 when there is no such profile
+        """
+        compiled = self.profiles.get(profile or DEFAULT_PROFILE)
+        if compiled is None:
+            abort(404)
+        return compiled
 
-    def route_change_password_static(self, filename):
-        return send_from_directory(self.base_dir, filename)
+    @property
+    def rules(self):
+        return self.profiles[DEFAULT_PROFILE].rules
 
-    def valid_password(self, password='', username=''):
-        score = 0
-        try:
-            score = self.password_good_enough(password=password, username=username)
-        except Exception as e:
-            return str(e)
+    @property
+    def min_password_length(self):
+        return self.rules['min_password_length']
 
-        return score
+    @property
+    def validator(self):
+        return self.profiles[DEFAULT_PROFILE].validator
 
-    def valid_username(self, username):
-        try:
-            self.check_username(username=username)
-        except Exception as e:
-            return str(e)
+    @property
+    def estimator(self):
+        return self.profiles[DEFAULT_PROFILE].estimator
 
-        return ''
+    @property
+    def rules_version(self):
+        return self.profiles[DEFAULT_PROFILE].version
 
-    def check_username(self, username):
+    @property
+    def common_passwords(self):
         """
-        raise exception if user name is not valid
-        :param username:
+        common password matcher of the default profile, None until loaded
         """
-        if len(username) < self.rules['username_length']:
-            raise Exception(self.messages['too_short'].format(self.rules['username_length']))
+        return self.resources.get(('passwords', self.rules['passwords_index']))
 
-        if not re.search('^[A-Za-z0-9]+(?:[ .-][A-Za-z0-9]+)*$', username):
-            raise Exception(self.messages['invalid_username'])
+    @property
+    def pwned_index(self):
+        return self.resources.get(('pwned_index', self.rules['pwned_index'], self.rules['pwned_min_count']))
 
-        if username.startswith('.') or username.endswith('.'):
-            raise Exception(self.messages['not_start_end_with_dot'])
+    @property
+    def pwned_bloom(self):
+        return self.resources.get(('pwned_bloom', self.rules['pwned_bloom']))
 
-        if username.startswith('-') or username.endswith('-'):
-            raise Exception(self.messages['not_start_end_with_hyphen'])
+    @staticmethod
+    def resource_keys(rules):
+        """
+        :return: set of the resource keys of the files the rules name
+        """
+        keys = {('passwords', rules['passwords_index']), ('pwned_bloom', rules['pwned_bloom']),
+                ('pwned_index', rules['pwned_index'], rules['pwned_min_count'])}
+        keys.update(('dictionary', filename) for filename in rules['dictionaries'])
+        return keys
 
-        if self.rules['username_requires_separators']:
-            if '.' not in username and '-' not in username:
-                raise Exception(self.messages['dot_or_hyphen_required'])
+    def prune_resources(self):
+        """
+        forget and close the loaded files no profile names.  A file stays
+        loaded while any profile names it, rebuild a file under a new name to
+        load the new version.
+        """
+        used = set()
+        for profile in self.profiles.values():
+            used |= self.resource_keys(profile.rules)
+        resources = dict((key, value) for key, value in self.resources.items() if key in used)
+        unused = [value for key, value in self.resources.items() if key not in used]
+        self.resources = resources
+        for resource in unused:
+            close = getattr(resource, 'close', None)
+            if close is not None:
+                try:
+                    close()
+                except BufferError:
+                    # a check still reading it, the map is freed when that check ends
+                    pass
+
+    def get_resource(self, key, load):
+        """
+        load a file once, however many profiles name it
+        :param key: (kind, file name, ...)
+        :param load: function loading the file
+        """
+        resource = self.resources.get(key)
+        if resource is None:
+            with self.lock:
+                resource = self.resources.get(key)
+                if resource is None:
+                    resource = load()
+                    # copied, so readers never see the dict change
+                    resources = dict(self.resources)
+                    resources[key] = resource
+                    self.resources = resources
+        return resource
+
+    def pwned_mode(self, profile=None):
+        """
+        the pwned rule as one of remote, local or off.  True is remote.
+        :param profile: profile name, default is the default profile
+        """
+        return self.get_profile(profile).pwned_mode
+
+    def get_template(self):
+        """
+        compile the change password template once per application
+        :return: jinja2 Template
+        """
+        app = current_app._get_current_object()
+        template = self.templates.get(app)
+        if template is None:
+            with open(os.path.join(self.base_dir, 'change_password_template.html')) as f:
+                template = app.jinja_env.from_string(f.read())
+            self.templates[app] = template
+        return template
+
+    def change_password_template(self, form, submit_text='', profile=None):
+        compiled = self.get_profile(profile)
+        return render_template(self.get_template(), form=form, rules_text=compiled.rules_text,
+                               submit_text=submit_text, script_url=self.static_url('pageChangePassword.js'),
+                               rules_json=compiled.rules_json[1], profile=profile or '', live_url=self.live_url)
+
+    def get_assets(self):
+        """
+        read the servable static files once
+        :return: dict of file name to StaticAsset
+        """
+        if self.assets is None:
+            self.assets = load_assets(self.base_dir)
+        return self.assets
+
+    def static_url(self, filename):
+        """
+        :return: url of a static file, versioned by its content hash
+        """
+        return url_for('route_change_password_static', filename=filename, v=self.get_assets()[filename].version)
+
+    def route_change_password_static(self, filename):
+        asset = self.get_assets().get(filename)
+        if asset is None:
+            abort(404)
+        encoding = asset.choose_encoding(request.accept_encodings)
+        response = current_app.response_class(asset.variants[encoding], mimetype=asset.mimetype)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(asset.etag(encoding))
+        # versioned urls never change, anything else must revalidate
+        if request.args.get('v') == asset.version:
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        else:
+            response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+        return response.make_conditional(request)
+
+    def valid_password(self, password='', username='', profile=None):
+        result = self.validate(password=password, username=username, profile=profile)
+        return result.score if result.valid else result.messages[0]
+
+    def validate_many(self, passwords, processes=None, batch_size=10000, profile=None):
+        """
+        validate many passwords, yielding results in input order as they are
+        ready.  The rules run in a process pool and pwned lookups are grouped
+        by hash prefix so each range is fetched once per batch.
+        :param passwords: iterable of (password, username)
+        :param processes: size of the process pool, default is the cpu count.  0 runs the rules in this process
+        :param batch_size: passwords validated at a time
+        :param profile: profile name, default is the default profile
+        :return: generator of (password, username, score or error message)
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        profile = self.get_profile(profile)
+        processes = (os.cpu_count() or 1) if processes is None else processes
+        pool = None
+        if processes:
+            pool = ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(profile.rules,))
+        try:
+            passwords = iter(passwords)
+            while True:
+                batch = [(password, username or '') for password, username in itertools.islice(passwords, batch_size)]
+                if not batch:
+                    return
+                if pool:
+                    chunk_size = -(-len(batch) // (processes * 4))
+                    chunks = [batch[i:i + chunk_size] for i in range(0, len(batch), chunk_size)]
+                    results = list(itertools.chain.from_iterable(pool.map(_worker_rules_scores, chunks)))
+                else:
+                    results = [self._valid_rules(password, username, profile) for password, username in batch]
+                self._check_pwned_batch(batch, results, profile)
+                for (password, username), result in zip(batch, results):
+                    yield password, username, result
+        finally:
+            if pool:
+                pool.shutdown()
+
+    def _check_pwned_batch(self, batch, results, profile):
+        """
+        replace the results of passwords in the batch failing the pwned check
+        with the message, as validate does for a single password
+        """
+        if profile.pwned_mode == 'off':
+            return
+
+        def check(position, outcome):
+            failure, cacheable = outcome
+            if failure:
+                results[position] = failure
+
+        # positions that passed the rules and still need a remote pwned check, by hash prefix
+        prefixes = {}
+        for position, (password, username) in enumerate(batch):
+            if not isinstance(results[position], int) or profile.validator.long_password(password):
+                continue
+            try:
+                count = self._pwned_count(password, profile)
+            except Exception as e:
+                check(position, self._pwned_error(e, profile))
+                continue
+            if count is None:
+                full_hash = hashlib.sha1(password.encode()).hexdigest().upper()
+                prefixes.setdefault(full_hash[:5], []).append((position, full_hash[5:]))
+            else:
+                check(position, self._pwned_found(count, profile))
+        if not prefixes:
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        def fetch(prefix):
+            try:
+                return prefix, self.pwned_client.get_range(prefix), None
+            except Exception as e:
+                return prefix, None, e
+
+        with ThreadPoolExecutor(self.pwned_client.pool_size) as executor:
+            for prefix, suffixes, error in executor.map(fetch, list(prefixes)):
+                failed = self._pwned_error(error, profile) if error is not None else None
+                for position, suffix in prefixes[prefix]:
+                    check(position, failed if error is not None else self._pwned_found(suffixes.get(suffix, 0),
+                                                                                       profile))
+
+    def _valid_rules(self, password, username, profile):
+        result = profile.validator.validate(password, username, metrics=self.metrics)
+        return result.score if result.valid else result.messages[0]
+
+    def valid_username(self, username, profile=None):
+        result = self.validate_username(username, profile=profile)
+        return '' if result.valid else result.messages[0]
+
+    def check_username(self, username, profile=None):
+        """
+        raise exception if user name is not valid
+        :param username:
+        :param profile: profile name, default is the default profile
+        """
+        result = self.validate_username(username, profile=profile)
+        if not result.valid:
+            raise Exception(result.messages[0])
+
+    def validate_username(self, username, collect_all=False, profile=None):
+        """
+        :param username:
+        :param collect_all: apply every rule and report all failures, otherwise stop at the first
+        :param profile: profile name, default is the default profile
+        :return: ValidationResult, with no score
+        """
+        rules = self.get_profile(profile).rules
+        result = ValidationResult(None)
+        checks = [('username_length', len(username) < rules['username_length'],
+                   self.messages['too_short'].format(rules['username_length'])),
+                  ('invalid_username', not USERNAME_RE.search(username), self.messages['invalid_username']),
+                  ('not_start_end_with_dot', username.startswith('.') or username.endswith('.'),
+                   self.messages['not_start_end_with_dot']),
+                  ('not_start_end_with_hyphen', username.startswith('-') or username.endswith('-'),
+                   self.messages['not_start_end_with_hyphen']),
+                  ('dot_or_hyphen_required', rules['username_requires_separators'] and
+                   '.' not in username and '-' not in username, self.messages['dot_or_hyphen_required'])]
+        for rule, failed, message in checks:
+            if failed:
+                result.failures.append((rule, message))
+                if not collect_all:
+                    break
+        return result
+
+    def rate_limited(self, count=1):
+        """
+        :param count: passwords the request checks, each costs a token
+        :return: a 429 response when the client is over its rate limit, otherwise None
+        """
+        if self.rate_limiter is None:
+            return None
+        keys = ['ip:{}'.format(request.remote_addr)]
+        if session.get('csrf_token'):
+            keys.append('session:{}'.format(session['csrf_token']))
+        if self.rate_limiter.allow(keys, count):
+            return None
+        retry_after = int(math.ceil(1 / self.rate_limiter.rate)) if self.rate_limiter.rate > 0 else 60
+        return 'too many requests', 429, {'Retry-After': str(retry_after)}
 
     def route_check_password(self):
+        self.count_request('check_password')
+        limited = self.rate_limited()
+        if limited:
+            return limited
+        profile = self.request_profile(request.json.get('profile'))
         password = request.json.get('password', '')
         username = request.json.get('username', '')
-        try:
-            score = self.password_good_enough(password=password, username=username)
-        except Exception as e:
-            return str(e)
-
-        return str(score)
-
-    def get_rules_text(self):
-        rules_text = '''Must be at least {min_password_length} characters long.'''.format(
-            min_password_length=self.rules['min_password_length'])
-
-        if self.rules['uppercase'] > 0:
-            rules_text += ''' Must include at least {} uppercase.'''.format(self.rules['uppercase'])
-        if self.rules['numbers'] > 0:
-            rules_text += ''' Must include at least {} number{}.'''.format(self.rules['numbers'], self.plural(self.rules['numbers']))
-        if self.rules['lowercase'] > 0:
-            rules_text += ''' Must include at least {} lowercase.'''.format(self.rules['lowercase'])
-        if self.rules['punctuation'] > 0:
-            rules_text += ''' Must include at least {} punctuation character{}.'''.format(self.rules['punctuation'], self.plural(self.rules['punctuation']))
-        if self.rules['username']:
-            rules_text += ''' Cannot include your user name.'''
-        if self.rules['number_sequence']:
-            rules_text += ''' Cannot include number sequences.'''
-        if self.rules['keyboard_sequence']:
-            rules_text += ''' Cannot include keyboard letter sequences.'''
-        if self.rules['alphabet_sequence']:
-            rules_text += ''' Cannot include alphabetic sequences.'''
-        if self.rules['pwned']:
-            rules_text += ''' Cannot be a pwned password.'''
-        if self.rules['passwords']:
-            rules_text += ''' Cannot be like a common password.'''
-        if self.rules['long_password_override'] > 1:
-            rules_text += ' Rules do not apply if password is greater than {} characters.'.format(
-                self.rules['long_password_override'] * self.min_password_length)
-
-        return rules_text
+        result = self.validate(password=password, username=username, profile=profile)
+        return str(result.score) if result.valid else result.messages[0]
+
+    def route_validate_password(self):
+        """
+        check a JSON {password, username, profile} against every rule
+        :return: JSON {valid, score, failures: [{rule, message}]} with all the failures
+        """
+        self.count_request('validate_password')
+        limited = self.rate_limited()
+        if limited:
+            return limited
+        profile = self.request_profile(request.json.get('profile'))
+        password = request.json.get('password', '')
+        username = request.json.get('username', '')
+        return jsonify(self.validate(password=password, username=username, collect_all=True,
+                                     profile=profile).to_dict())
+
+    def route_check_passwords(self):
+        """
+        validate a JSON list of {password, username} objects, with an optional profile
+        :return: JSON list of scores or error messages in the same order
+        """
+        self.count_request('check_passwords')
+        items = request.json.get('passwords', [])
+        if len(items) > self.bulk_limit:
+            return jsonify(error='too many passwords.  Maximum {}'.format(self.bulk_limit)), 413
+        limited = self.rate_limited(max(1, len(items)))
+        if limited:
+            return limited
+        profile = self.request_profile(request.json.get('profile'))
+        results = self.validate_many(((item.get('password', ''), item.get('username', '')) for item in items),
+                                     processes=0, profile=profile)
+        return jsonify([result for password, username, result in results])
+
+    def route_live(self, ws):
+        """
+        serve a live check WebSocket, see LiveChannel
+        :param ws: flask-sock WebSocket
+        """
+        from simple_websocket import ConnectionClosed
+
+        from .live import LiveChannel
+
+        # browsers let any site open a WebSocket, only serve pages of this one
+        origin = request.headers.get('Origin')
+        if origin and origin.split('://', 1)[-1] != request.host:
+            return
+
+        def receive(timeout):
+            try:
+                return ws.receive(timeout)
+            except ConnectionClosed:
+                raise EOFError from None
+
+        LiveChannel(self, receive, ws.send).serve()
+
+    async def route_check_password_async(self):
+        self.count_request('check_password')
+        limited = self.rate_limited()
+        if limited:
+            return limited
+        data = request.get_json()
+        profile = self.request_profile(data.get('profile'))
+        password = data.get('password', '')
+        username = data.get('username', '')
+        result = await self.validate_async(password=password, username=username, profile=profile)
+        return str(result.score) if result.valid else result.messages[0]
+
+    async def route_validate_password_async(self):
+        self.count_request('validate_password')
+        limited = self.rate_limited()
+        if limited:
+            return limited
+        data = request.get_json()
+        profile = self.request_profile(data.get('profile'))
+        result = await self.validate_async(password=data.get('password', ''), username=data.get('username', ''),
+                                           collect_all=True, profile=profile)
+        return jsonify(result.to_dict())
+
+    def get_rules_text(self, profile=None):
+        """
+        :param profile: profile name, default is the default profile
+        :return: the rules described for the user
+        """
+        return self.get_profile(profile).rules_text
+
+    def get_common_passwords(self, profile=None):
+        """
+        load the common password list once into a matcher.  When there is a
+        passwords_index it is memory mapped, and shared with other processes,
+        instead.
+        :param profile: profile name, default is the default profile
+        :return: CommonPasswordMatcher or MappedPasswordMatcher
+        """
+        return self.load_common_passwords(self.get_profile(profile).rules['passwords_index'])
+
+    def load_common_passwords(self, passwords_index):
+        if passwords_index:
+            return self.get_resource(('passwords', passwords_index),
+                                     lambda: MappedPasswordMatcher(passwords_index))
+        return self.get_resource(('passwords', ''), lambda: CommonPasswordMatcher.from_file(COMMON_PASSWORDS_FILE))
+
+    def get_dictionaries(self, profile=None):
+        """
+        open the dictionary indexes named by the dictionaries rule
+        :param profile: profile name, default is the default profile
+        :return: list of DictionaryIndex
+        """
+        return self.load_dictionaries(self.get_profile(profile).rules['dictionaries'])
+
+    def load_dictionaries(self, filenames):
+        return [self.get_resource(('dictionary', filename), lambda: DictionaryIndex(filename))
+                for filename in filenames]
 
     @staticmethod
     def count_characters(password, char_set):
@@ -143,170 +668,302 @@ class ChangePassword:
 
     @staticmethod
     def plural(number):
-        return 's' if number > 1 else ''
+        return plural(number)
+
+    def long_password(self, password, profile=None):
+        """
+        :return: True when the password is long enough for the rules not to apply
+        """
+        return self.get_profile(profile).validator.long_password(password)
 
-    def password_good_enough(self, password, username=''):
+    def password_good_enough(self, password, username='', profile=None):
         """
         valid_password if the password is sufficiently secure
         raise exception if there are faults
         :param password:
         :param username: username to valid_password if used in password
+        :param profile: profile name, default is the default profile
         :return: strength score out of 5
         """
-        score = 0
-        if len(password) < self.rules['min_password_length']:
-            raise Exception('insufficient length.  Required {}'.format(self.rules['min_password_length']))
-
-        if self.rules['long_password_override'] > 1 and len(password) > self.rules['long_password_override'] * \
-                self.rules['min_password_length']:
-            return 5
-
-        # only apply these tests if password is of 'middling length'
-        if self.rules['uppercase'] > 0:
-            found_count = self.count_characters(password, string.ascii_letters.upper())
-            if found_count < self.rules['uppercase']:
-                raise Exception('{} uppercase required'.format(self.rules['uppercase']))
-        score += 1
-
-        if self.rules['lowercase'] > 0 and not re.search(r'[a-z]', password):
-            found_count = self.count_characters(password, string.ascii_letters.lower())
-            if found_count < self.rules['lowercase']:
-                raise Exception('{} lowercase required'.format(self.rules['lowercase']))
-        score += 1
-
-        if self.rules['numbers'] > 0:
-            found_count = self.count_characters(password, string.digits)
-            if found_count < self.rules['numbers']:
-                raise Exception(
-                    '{} number{} required'.format(self.rules['numbers'], self.plural(self.rules['numbers'])))
-        score += 1
-
-        if self.rules['punctuation'] > 0:
-            punctuation = self.count_characters(password, string.punctuation)
-
-            if punctuation < self.rules['punctuation']:
-                raise Exception('{} punctuation{} required'.format(self.rules['punctuation'],
-                                                                   self.plural(self.rules['punctuation'])))
-        score += 1
-
-        if self.rules['username'] and len(username) > 0 and username.lower() in password.lower():
-            raise Exception('insufficient difference from username')
-
-        if self.rules['number_sequence']:
-            sequence_length = 3
-            for x in range(11 - sequence_length):
-                consecutive_sequence = ''.join([str(y) for y in range(x, x + sequence_length)])
-                if consecutive_sequence in password:
-                    raise Exception('not enough number complexity, {} disallowed'.format(consecutive_sequence))
-
-        if self.rules['alphabet_sequence']:
-            sequence_length = 4
-            for x in range(len(string.ascii_letters) - sequence_length):
-                consecutive_sequence = ''.join([string.ascii_letters[y] for y in range(x, x + sequence_length)])
-                if consecutive_sequence in password.lower():
-                    raise Exception('insufficient letter complexity, {} disallowed'.format(consecutive_sequence))
-
-        if self.rules['keyboard_sequence']:
-            keyboard = 'qwertyuiopasdfghjklzxcvbnm'
-            sequence_length = 4
-            for x in range(len(keyboard) - sequence_length):
-                consecutive_sequence = ''.join([keyboard[y] for y in range(x, x + sequence_length)])
-                if consecutive_sequence in password.lower():
-                    raise Exception('keyboard sequence found, {} disallowed'.format(consecutive_sequence))
-
-        if self.rules['passwords']:
-            with open(os.path.join(self.base_dir, '10_million_password_list_top_10000.txt')) as f:
-                for line in f:
-                    known_password = line.strip()
-                    if password.startswith(known_password) or len(known_password) * 2 > len(
-                            password) and known_password in password:
-                        raise Exception('too similar to common password: {}'.format(known_password))
-        score += 1
-
-        if self.rules['pwned']:
-            self.check_pwned(password)
-        return score
+        result = self.validate(password, username, profile=profile)
+        if not result.valid:
+            raise Exception(result.messages[0])
+        return result.score
 
-    @staticmethod
-    def check_pwned(password):
+    def validate(self, password, username='', collect_all=False, profile=None):
+        """
+        check the password against every rule, including pwned, without raising
+        :param password:
+        :param username: username to valid_password if used in password
+        :param collect_all: apply every rule and report all failures, otherwise stop at the first.  Either way
+            pwned is only checked when the rules pass.
+        :param profile: profile name, default is the default profile
+        :return: ValidationResult
+        """
+        # one profile for the whole validation, even if the rules change meanwhile
+        profile = self.get_profile(profile)
+        key, result = self.cached_result(password, username, collect_all, profile)
+        if result is not None:
+            return result
+        result = profile.validator.validate(password, username, collect_all, self.metrics)
+        # pwned is only looked up for passwords the rules accept, in either mode
+        if result.valid and profile.pwned_mode != 'off' and not profile.validator.long_password(password):
+            start = time.perf_counter()
+            failure, cacheable = self._pwned_outcome(password, profile)
+            if not self.pwned_checked(result, start, failure, cacheable):
+                return result
+        self.cache_result(key, result)
+        return result
+
+    def pwned_checked(self, result, start, failure, cacheable):
+        """
+        record the outcome of a pwned check in the result
+        :param failure: message when the password failed the check, otherwise None
+        :param cacheable: False when the outcome, such as an unavailable service, must not be cached
+        :return: cacheable
+        """
+        if self.metrics is not None:
+            self.metrics.observe('pwned', time.perf_counter() - start)
+            if failure and cacheable:
+                self.metrics.reject('pwned')
+        if failure:
+            result.fail('pwned', failure)
+        return cacheable
+
+    def cached_result(self, password, username, collect_all=False, profile=None):
+        """
+        look up the result of checking password and username in the result
+        cache.  First failure and collect_all results are cached under different keys.
+        :return: (cache key or None when not cached, ValidationResult or None when not found)
+        """
+        if self.result_cache is None:
+            return None, None
+        version = self.get_profile(profile).version
+        key = self.result_cache.key(password, username, '{}:all'.format(version) if collect_all else version)
+        found, result = self.result_cache.get(key)
+        if not found:
+            return key, None
+        score, failures = result
+        return key, ValidationResult(score, list(failures))
+
+    def cache_result(self, key, result):
+        """
+        cache the score and failures of a ValidationResult
+        """
+        if key is None:
+            return
+        self.result_cache.put(key, (result.score, tuple(result.failures)))
+
+    async def password_good_enough_async(self, password, username='', profile=None):
+        """
+        asyncio version of password_good_enough.  The CPU bound rules run in
+        the default executor and the pwned check does not block the event loop.
+        :param password:
+        :param username: username to valid_password if used in password
+        :return: strength score out of 5
+        """
+        result = await self.validate_async(password, username, profile=profile)
+        if not result.valid:
+            raise Exception(result.messages[0])
+        return result.score
+
+    async def validate_async(self, password, username='', collect_all=False, profile=None):
+        """
+        asyncio version of validate
+        :return: ValidationResult
+        """
+        profile = self.get_profile(profile)
+        key, result = self.cached_result(password, username, collect_all, profile)
+        if result is not None:
+            return result
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, profile.validator.validate, password, username, collect_all,
+                                            self.metrics)
+        # pwned is only looked up for passwords the rules accept, in either mode
+        if result.valid and profile.pwned_mode != 'off' and not profile.validator.long_password(password):
+            start = time.perf_counter()
+            failure, cacheable = await self._pwned_outcome_async(password, profile)
+            if not self.pwned_checked(result, start, failure, cacheable):
+                return result
+        self.cache_result(key, result)
+        return result
+
+    def estimate_strength(self, password, username='', profile=None):
+        """
+        estimate the guesses needed to find the password, whatever the rules
+        :param password:
+        :param username: counted as the most common password when found in the password
+        :param profile: profile name, default is the default profile
+        :return: Estimate with guesses, a score from 0 to 4 and the sequence of matches
+        """
+        return self.get_profile(profile).estimator.estimate(password, [username] if username else ())
+
+    def get_pwned_index(self, profile=None):
+        """
+        open the local pwned index named by the pwned_index rule
+        :param profile: profile name, default is the default profile
+        :return: LocalPwnedIndex
+        """
+        rules = self.get_profile(profile).rules
+        if not rules['pwned_index']:
+            raise ValueError('pwned_index rule required for local pwned checking')
+
+        def load():
+            try:
+                return LocalPwnedIndex(rules['pwned_index'], min_count=rules['pwned_min_count'])
+            except OSError as e:
+                raise ValueError('pwned_index rule: cannot open {}: {}'.format(rules['pwned_index'],
+                                                                             e.strerror or e)) from e
+
+        return self.get_resource(('pwned_index', rules['pwned_index'], rules['pwned_min_count']), load)
+
+    def get_pwned_bloom(self, profile=None):
+        """
+        load the bloom filter named by the pwned_bloom rule
+        :param profile: profile name, default is the default profile
+        :return: BloomFilter or None when there is no filter
+        """
+        filename = self.get_profile(profile).rules['pwned_bloom']
+        if not filename:
+            return None
+        return self.get_resource(('pwned_bloom', filename), lambda: BloomFilter.load(filename))
+
+    def not_pwned_by_filter(self, password, profile=None):
+        """
+        :return: True when the bloom filter proves the password is not pwned
+        """
+        bloom_filter = self.get_pwned_bloom(profile)
+        return bloom_filter is not None and not bloom_filter.might_be_pwned(password)
+
+    def check_pwned(self, password, profile=None):
         """
         raise exception if password hashed using sha1 is in the pwned passwords
-        database.
+        database.  Uses the local index when the pwned rule is 'local'.  When
+        there is a pwned_bloom filter only its positives are confirmed.  Raises
+        PwnedUnavailable when the check could not be made and the pwned_failure
+        rule is 'closed'.
 
         see: https://haveibeenpwned.com/API/v2#PwnedPasswords
         :param password:
+        :param profile: profile name, default is the default profile
+        :return:
+        """
+        self._raise_pwned(*self._pwned_outcome(password, self.get_profile(profile)))
+
+    async def check_pwned_async(self, password, profile=None):
+        """
+        asyncio version of check_pwned
+        :param password:
+        :param profile: profile name, default is the default profile
         :return:
         """
-        hash_object = hashlib.sha1(password.encode())
-        full_hash = hash_object.hexdigest().upper()
-        hex_dig_first5 = full_hash[:5]
-        hash_search_string = full_hash[5:] + ':'
-        response = requests.get(PWNED_URL + 'range/' + hex_dig_first5)
-        if response.status_code == 200:
-            search_space = response.content.decode('utf-8')
-            if hash_search_string in search_space:
-                raise Exception('is a known hacked password')
-
-    def verify_password_change_form(self, form):
+        self._raise_pwned(*await self._pwned_outcome_async(password, self.get_profile(profile)))
+
+    @staticmethod
+    def _raise_pwned(failure, cacheable):
+        if failure:
+            raise Exception(failure) if cacheable else PwnedUnavailable(failure)
+
+    def _pwned_count(self, password, profile):
+        """
+        :return: times the password has been seen, 0 when the bloom filter rules it out, or None when the
+            remote service has to be asked
+        """
+        if self.not_pwned_by_filter(password, profile):
+            return 0
+        if profile.pwned_mode == 'local':
+            return self.get_pwned_index(profile).count(sha1_digest(password))
+        return None
+
+    def _pwned_outcome(self, password, profile):
+        """
+        check password against the pwned passwords without raising
+        :param profile: RuleProfile
+        :return: (failure message or None, True when the outcome can be cached)
+        """
+        try:
+            count = self._pwned_count(password, profile)
+            if count is None:
+                count = self.pwned_client.count(password)
+        except Exception as e:
+            return self._pwned_error(e, profile)
+        return self._pwned_found(count, profile)
+
+    async def _pwned_outcome_async(self, password, profile):
+        """
+        asyncio version of _pwned_outcome
+        """
+        try:
+            count = self._pwned_count(password, profile)
+            if count is None:
+                count = await self.pwned_client.count_async(password)
+        except Exception as e:
+            return self._pwned_error(e, profile)
+        return self._pwned_found(count, profile)
+
+    @staticmethod
+    def _pwned_found(count, profile):
+        """
+        :param count: times the password has been seen
+        :return: outcome, see _pwned_outcome
+        """
+        if count and count >= profile.rules['pwned_min_count']:
+            return 'is a known hacked password', True
+        return None, True
+
+    @staticmethod
+    def _pwned_error(error, profile):
+        """
+        apply the pwned_failure rule to a check that could not be made.  When
+        failing closed the password fails, when failing open it is accepted.
+        Neither is cached, the password is checked again once the service is back.
+        :return: outcome, see _pwned_outcome
+        """
+        if not isinstance(error, PwnedUnavailable):
+            # such as a missing pwned_index, the details are for the server log not the client
+            logger.error('pwned check failed: %s', error)
+            error = PwnedUnavailable('pwned check failed, try again')
+        if profile.rules['pwned_failure'] == 'open':
+            return None, False
+        return str(error), False
+
+    def verify_password_change_form(self, form, profile=None):
+        rules = self.get_profile(profile).rules
         try:
-            self.password_good_enough(form.password.data, form.username.data)
+            self.password_good_enough(form.password.data, form.username.data, profile=profile)
         except Exception as e:
-            if self.rules.get('flash'):
+            if rules.get('flash'):
                 flash(str(e))
             return False
 
         if form.password.data != form.password2.data:
-            if self.rules.get('flash'):
+            if rules.get('flash'):
                 flash('Password and repeat password not the same')
             return False
 
         if hasattr(form, 'old_password'):
             if form.old_password.data == form.password2.data:
-                if self.rules.get('flash'):
+                if rules.get('flash'):
                     flash('Current password and new password must be different')
 
                 return False
 
         return True
 
-    def verify_password_set_form(self, form):
+    def verify_password_set_form(self, form, profile=None):
+        rules = self.get_profile(profile).rules
         valid = True
         if form.password.data != form.password2.data:
-            if self.rules.get('flash'):
+            if rules.get('flash'):
                 flash('Password and repeat password not the same')
 
             valid = False
-        elif len(form.password.data) < self.rules['min_password_length']:
-            if self.rules.get('flash'):
+        elif len(form.password.data) < rules['min_password_length']:
+            if rules.get('flash'):
                 flash('Password too short')
 
             valid = False
         return valid
 
-
-class ChangePasswordForm(FlaskForm):
-    password_length = HiddenField('password_length')
-    title = HiddenField('title')
-    username = HiddenField('username')
-    changing = HiddenField('changing', default=True)
-    old_password = PasswordField('Current Password', validators=[DataRequired()],
-                                 render_kw={'data-bind': 'textInput: old_password'})
-    password = PasswordField('New Password', validators=[DataRequired()],
-                             render_kw={'data-bind': 'textInput: password1', 'required': 'required'})
-    password2 = PasswordField(
-        'Repeat New Password', validators=[DataRequired(), EqualTo('password')],
-        render_kw={'data-bind': 'textInput: password2', 'required': 'required'})
-    submit = SubmitField('Submit', render_kw={'data-bind': 'visible: verified()'})
-
-
-class SetPasswordForm(FlaskForm):
-    password_length = HiddenField('password_length')
-    title = HiddenField('title')
-    username = HiddenField('username')
-    changing = HiddenField('changing', default=False)
-    password = PasswordField('New Password', validators=[DataRequired()],
-                             render_kw={'data-bind': 'textInput: password1', 'required': 'required'})
-    password2 = PasswordField(
-        'Repeat New Password', validators=[DataRequired(), EqualTo('password')],
-        render_kw={'data-bind': 'textInput: password2', 'required': 'required'})
-    submit = SubmitField('Submit', render_kw={'data-bind': 'visible: verified()'})
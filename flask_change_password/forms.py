@@ -0,0 +1,31 @@
+from flask_wtf import FlaskForm
+from wtforms import PasswordField, SubmitField, HiddenField
+from wtforms.validators import DataRequired, EqualTo
+
+
+class ChangePasswordForm(FlaskForm):
+    password_length = HiddenField('password_length')
+    title = HiddenField('title')
+    username = HiddenField('username')
+    changing = HiddenField('changing', default=True)
+    old_password = PasswordField('Current Password', validators=[DataRequired()],
+                                 render_kw={'data-bind': 'textInput: old_password'})
+    password = PasswordField('New Password', validators=[DataRequired()],
+                             render_kw={'data-bind': 'textInput: password1', 'required': 'required'})
+    password2 = PasswordField(
+        'Repeat New Password', validators=[DataRequired(), EqualTo('password')],
+        render_kw={'data-bind': 'textInput: password2', 'required': 'required'})
+    submit = SubmitField('Submit', render_kw={'data-bind': 'visible: verified()'})
+
+
+class SetPasswordForm(FlaskForm):
+    password_length = HiddenField('password_length')
+    title = HiddenField('title')
+    username = HiddenField('username')
+    changing = HiddenField('changing', default=False)
+    password = PasswordField('New Password', validators=[DataRequired()],
+                             render_kw={'data-bind': 'textInput: password1', 'required': 'required'})
+    password2 = PasswordField(
+        'Repeat New Password', validators=[DataRequired(), EqualTo('password')],
+        render_kw={'data-bind': 'textInput: password2', 'required': 'required'})
+    submit = SubmitField('Submit', render_kw={'data-bind': 'visible: verified()'})
@@ -0,0 +1,76 @@
+"""
+Live validation channel.  The page opens one WebSocket per form and sends
+check messages {"id": n, "password": ..., "username": ..., "profile": ...}
+as the user types.  Each is answered with the validate_password JSON and
+its id.  When checks arrive faster than they are validated only the newest
+is answered, the rest are superseded and dropped.
+"""
+import json
+
+from .profiles import DEFAULT_PROFILE
+
+LIVE_PATH = '/flask_change_password/live'
+
+
+class LiveChannel:
+    """
+    Serves the check messages of one connection
+    """
+
+    def __init__(self, change_password, receive, send):
+        """
+        :param change_password: ChangePassword
+        :param receive: function(timeout) returning the next text message, or None when none arrived within
+            timeout seconds.  A timeout of None waits.  Raises EOFError when the connection is closed.
+        :param send: function(text) sending a message
+        """
+        self.change_password = change_password
+        self.receive = receive
+        self.send = send
+        self.answered = 0
+        self.dropped = 0
+
+    def serve(self):
+        """
+        answer check messages until the connection is closed
+        """
+        try:
+            while True:
+                self.send(json.dumps(self.answer(self.newest(self.receive(None)))))
+                self.answered += 1
+        except EOFError:
+            return
+
+    def newest(self, text):
+        """
+        :param text: message just received
+        :return: the last message already waiting, dropping the ones it supersedes
+        """
+        while True:
+            waiting = self.receive(0)
+            if waiting is None:
+                return text
+            self.dropped += 1
+            text = waiting
+
+    def answer(self, text):
+        """
+        :param text: check message
+        :return: dict of the validation result and the message id, or an error and the id
+        """
+        try:
+            message = json.loads(text)
+        except ValueError:
+            message = None
+        if not isinstance(message, dict):
+            return dict(id=None, error='invalid check message')
+        change_password = self.change_password
+        change_password.count_request('live_check')
+        if change_password.rate_limited():
+            return dict(id=message.get('id'), error='too many requests')
+        profile = change_password.profiles.get(message.get('profile') or DEFAULT_PROFILE)
+        if profile is None:
+            return dict(id=message.get('id'), error='unknown rule profile')
+        result = change_password.validate(str(message.get('password', '')), str(message.get('username', '')),
+                                          collect_all=True, profile=profile)
+        return dict(result.to_dict(), id=message.get('id'))
@@ -0,0 +1,87 @@
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+PREFIX = 'flask_change_password'
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(name, value):
+    return '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+class Metrics:
+    """
+    Per rule latency histograms, rejection counts by rule and request counts.
+    Each event is also passed to the callbacks as (kind, name, value) where
+    kind is 'latency', 'rejection' or 'request'.
+    """
+
+    def __init__(self, callbacks=None, buckets=LATENCY_BUCKETS):
+        self.callbacks = list(callbacks or [])
+        self.buckets = buckets
+        self.latencies = {}
+        self.rejections = {}
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def _notify(self, kind, name, value):
+        for callback in self.callbacks:
+            callback(kind, name, value)
+
+    def observe(self, rule, seconds):
+        with self._lock:
+            histogram = self.latencies.get(rule)
+            if histogram is None:
+                histogram = self.latencies[rule] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        self._notify('latency', rule, seconds)
+
+    def reject(self, rule):
+        with self._lock:
+            self.rejections[rule] = self.rejections.get(rule, 0) + 1
+        self._notify('rejection', rule, 1)
+
+    def request(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        self._notify('request', endpoint, 1)
+
+    def prometheus_text(self, gauges=None):
+        """
+        :param gauges: dict of name to value of other statistics to include
+        :return: metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            name = PREFIX + '_rule_seconds'
+            lines.append('# TYPE {} histogram'.format(name))
+            for rule, histogram in sorted(self.latencies.items()):
+                cumulative = 0
+                for bound, count in zip(list(self.buckets) + ['+Inf'], histogram.counts):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},{}}} {}'.format(name, _labels('rule', rule), _labels('le', bound),
+                                                               cumulative))
+                lines.append('{}_sum{{{}}} {}'.format(name, _labels('rule', rule), histogram.sum))
+                lines.append('{}_count{{{}}} {}'.format(name, _labels('rule', rule), histogram.count))
+            for name, label, counts in [(PREFIX + '_rejections_total', 'rule', self.rejections),
+                                        (PREFIX + '_requests_total', 'endpoint', self.requests)]:
+                lines.append('# TYPE {} counter'.format(name))
+                for key, count in sorted(counts.items()):
+                    lines.append('{}{{{}}} {}'.format(name, _labels(label, key), count))
+        for name, value in sorted((gauges or {}).items()):
+            lines.append('# TYPE {}_{} gauge'.format(PREFIX, name))
+            lines.append('{}_{} {}'.format(PREFIX, name, value))
+        return '\n'.join(lines) + '\n'
@@ -16,24 +16,38 @@ class FlaskChangePasswordViewModel {
         this.minPasswordCheckLength = Number(this.getInputValue("password_length"));
         this.showHidePassword = ko.observable(true);
         this.rules = {};
+        // rule profile of the form, empty for the default profile
+        this.profile = this.getInputValue("rule_profile");
 
-        fetch('/flask_change_password/get_rules').then(result => result.json()).then(result => {
+        // rules are inlined by change_password_template, otherwise fetched
+        const inlineRules = document.getElementById("flask_change_password_rules");
+        const rules = inlineRules ? Promise.resolve(JSON.parse(inlineRules.textContent)) :
+            fetch('/flask_change_password/get_rules' + (this.profile ? '?profile=' + encodeURIComponent(this.profile) : ''))
+                .then(result => result.json());
+        rules.then(result => {
             this.rules = result;
             if (Number(this.minPasswordCheckLength) <= 0) {
                 this.minPasswordCheckLength = Number(this.rules.min_password_length)
             }
             this.showHidePassword(this.rules.show_hide_passwords)
         });
+        this.punctuation = "!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~";
         this.addMessageSpans();
-        this.previous = {};
+        this.debounceTimer = null;
+        this.checkSequence = 0;
+        this.checkController = null;
+        this.lastChecked = null;
+        // live check channel, null until open and when unavailable, then checks are POSTed
+        this.live = null;
+        this.livePending = null;
+        this.openLive();
         this.old_passwordMessage.subscribe(newValue => this.old_passwordCheck());
         this.password1Message.subscribe(newValue => this.password1Check());
         this.password2Message.subscribe(newValue => this.password2Check());
+        [this.old_password, this.password1, this.password2].forEach(
+            observable => observable.subscribe(newValue => this.scheduleCheck()));
         // start knockout up.
         ko.applyBindings(this, document.getElementById('change_password_div'));
-        setInterval(() => {
-            this.intervalHandler();
-        }, 1500);
         this.messages = {
             currentPasswordRequired: 'Current password required',
             passwordNotLongEnough: "password not long enough",
@@ -51,23 +65,32 @@ class FlaskChangePasswordViewModel {
         return ''
     }
 
-    intervalHandler() {
-        const previousCheck = {a: this.old_password(), b: this.password1(), c: this.password2()};
-        if (JSON.stringify(previousCheck) === JSON.stringify(this.previous)) {
-            return;
-        }
-        this.previous = previousCheck;
+    scheduleCheck() {
+        // check once typing pauses for the check_password_debounce rule milliseconds
+        clearTimeout(this.debounceTimer);
+        const debounce = this.rules.check_password_debounce === undefined ? 300 : this.rules.check_password_debounce;
+        this.debounceTimer = setTimeout(() => this.inputHandler(), Number(debounce));
+    }
+
+    inputHandler() {
         if (this.changing() && this.old_password().length < this.minPasswordCheckLength) {
             this.old_passwordMessage(this.messages.currentPasswordRequired);
         } else {
             this.old_passwordMessage("");
         }
 
+        const localMessage = this.localPasswordCheck(this.password1());
         if (this.password1().length < this.minPasswordCheckLength) {
+            this.cancelCheck();
             this.password1Message(this.messages.passwordNotLongEnough);
         } else if (this.changing() && this.password1() == this.old_password()) {
+            this.cancelCheck();
             this.password1Message(this.messages.passwordNotDifferentFomCurrentPassword);
-        } else {
+        } else if (localMessage) {
+            this.cancelCheck();
+            this.password1Message(localMessage);
+            this.password1Strength(0);
+        } else if (this.password1() !== this.lastChecked) {
             this.checkPassword1(this.password1());
         }
 
@@ -149,45 +172,132 @@ class FlaskChangePasswordViewModel {
         }
     }
 
-    serialize(id) {
-        // serialize form
-        const form = document.getElementById("change_password_form");
-        const data = {};
-        const inputs = [].slice.call(form.getElementsByTagName('input'));
-        inputs.forEach(input => {
-            data[input.name] = input.value;
-        });
-        return JSON.stringify(data);
-    }
-
-    checkPassword1(password, messageMethod) {
-        try {
-            const data = this.serialize("change_password_form");
-            const csrf_token = this.getInputValue('csrf_token');
-            fetch(
-                "/flask_change_password/check_password",
-                {
-                    method: "POST",
-                    headers: {
-                        'Accept': 'text/html',
-                        'Content-Type': 'application/json',
-                        "X-CSRFToken": csrf_token,
-                    },
-                    body: data,
-                }).then(result => result.text()).then(result => {
-                if (isNaN(result)) {
-                    this.password1Message(result);
-                    this.password1Strength(0);
-                } else {
-                    this.password1Strength(Number(result));
-                    this.password1Message("");
-                    return true;
-                }
-            });
-        } catch (e) {
-            this.message(`${e.statusText || ""} - problem found - refresh page`);
+    countCharacters(password, test) {
+        return Array.from(password).filter(test).length;
+    }
+
+    plural(number) {
+        return number > 1 ? 's' : '';
+    }
+
+    localPasswordCheck(password) {
+        // the length and character class rules, checked without a server round trip
+        const rules = this.rules;
+        if (rules.min_password_length === undefined) {
+            return "";
+        }
+        if (password.length < rules.min_password_length) {
+            return `insufficient length.  Required ${rules.min_password_length}`;
+        }
+        if (rules.long_password_override > 1 && password.length > rules.long_password_override * rules.min_password_length) {
+            return "";
+        }
+        if (this.countCharacters(password, c => c >= 'A' && c <= 'Z') < rules.uppercase) {
+            return `${rules.uppercase} uppercase required`;
+        }
+        if (rules.lowercase > 0 && this.countCharacters(password, c => c >= 'a' && c <= 'z') === 0) {
+            return `${rules.lowercase} lowercase required`;
+        }
+        if (this.countCharacters(password, c => c >= '0' && c <= '9') < rules.numbers) {
+            return `${rules.numbers} number${this.plural(rules.numbers)} required`;
         }
-        return false;
+        if (this.countCharacters(password, c => this.punctuation.includes(c)) < rules.punctuation) {
+            return `${rules.punctuation} punctuation${this.plural(rules.punctuation)} required`;
+        }
+        return "";
+    }
+
+    cancelCheck() {
+        this.lastChecked = null;
+        this.checkSequence += 1;
+        if (this.checkController) {
+            this.checkController.abort();
+            this.checkController = null;
+        }
+    }
+
+    openLive() {
+        const div = document.getElementById("change_password_div");
+        const url = div ? div.dataset.liveUrl : "";
+        if (!url || !window.WebSocket) {
+            return;
+        }
+        const socket = new WebSocket((location.protocol === "https:" ? "wss://" : "ws://") + location.host + url);
+        socket.onopen = () => this.live = socket;
+        socket.onmessage = evt => this.liveResult(JSON.parse(evt.data));
+        socket.onclose = () => {
+            this.live = null;
+            // a check the channel did not answer is POSTed instead
+            const pending = this.livePending;
+            this.livePending = null;
+            if (pending !== null && pending.sequence === this.checkSequence) {
+                this.checkPassword1(pending.password);
+            }
+        };
+    }
+
+    liveResult(result) {
+        const pending = this.livePending;
+        // answers to superseded checks are discarded
+        if (pending === null || result.id !== pending.sequence || result.id !== this.checkSequence) {
+            return;
+        }
+        this.livePending = null;
+        if (result.error) {
+            this.message(`${result.error} - problem found - refresh page`);
+            return;
+        }
+        this.showResult(pending.password, result);
+    }
+
+    showResult(password, result) {
+        this.lastChecked = password;
+        // every failure comes back at once, so fixing one does not reveal the next
+        this.password1Message(result.failures.map(failure => failure.message).join(" "));
+        this.password1Strength(result.score);
+    }
+
+    checkPassword1(password) {
+        // supersede any check still in flight, its response is discarded
+        this.cancelCheck();
+        const sequence = this.checkSequence;
+        if (this.live && this.live.readyState === WebSocket.OPEN) {
+            this.livePending = {sequence: sequence, password: password};
+            this.live.send(JSON.stringify({
+                id: sequence, password: password, username: this.getInputValue('username'), profile: this.profile
+            }));
+            return;
+        }
+        const controller = window.AbortController ? new AbortController() : null;
+        this.checkController = controller;
+        const csrf_token = this.getInputValue('csrf_token');
+        fetch(
+            "/flask_change_password/validate_password",
+            {
+                method: "POST",
+                headers: {
+                    'Accept': 'application/json',
+                    'Content-Type': 'application/json',
+                    "X-CSRFToken": csrf_token,
+                },
+                body: JSON.stringify({password: password, username: this.getInputValue('username'), profile: this.profile}),
+                signal: controller ? controller.signal : undefined,
+            }).then(result => {
+            if (!result.ok) {
+                throw result;
+            }
+            return result.json();
+        }).then(result => {
+            if (sequence !== this.checkSequence) {
+                return;
+            }
+            this.checkController = null;
+            this.showResult(password, result);
+        }).catch(e => {
+            if (e.name !== 'AbortError' && sequence === this.checkSequence) {
+                this.message(`${e.statusText || ""} - problem found - refresh page`);
+            }
+        });
     }
 
     clickToggleShowPassword(view, evt) {
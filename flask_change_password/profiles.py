@@ -0,0 +1,140 @@
+import hashlib
+import json
+
+from .strength import StrengthEstimator
+from .validator import PasswordValidator, plural
+
+DEFAULT_PROFILE = 'default'
+PWNED_MODES = ('remote', 'local', 'off')
+PWNED_FAILURES = ('closed', 'open')
+# rules the page needs, the only ones sent to clients.  Others, such as file paths, stay on the server.
+CLIENT_RULES = ('min_password_length', 'uppercase', 'lowercase', 'numbers', 'punctuation', 'long_password_override',
+                'show_hide_passwords', 'check_password_debounce')
+
+
+class FrozenRules(dict):
+    """
+    Read only rules dict, its list values are tuples.  Change rules with
+    ChangePassword.update_rules.
+    """
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError('rules are immutable, use update_rules to change them')
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return FrozenRules, (dict(self),)
+
+
+def freeze(value):
+    """
+    :return: value with lists, at any depth, as tuples
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def freeze_rules(rules):
+    """
+    :return: FrozenRules copy of rules with list values as tuples
+    """
+    return FrozenRules((key, freeze(value)) for key, value in rules.items())
+
+
+def pwned_mode(rules):
+    """
+    the pwned rule as one of remote, local or off.  True is remote.
+    """
+    pwned = rules['pwned']
+    if pwned is True:
+        return 'remote'
+    if not pwned:
+        return 'off'
+    return pwned
+
+
+def rules_text(rules):
+    """
+    :return: the rules described for the user
+    """
+    text = '''Must be at least {min_password_length} characters long.'''.format(
+        min_password_length=rules['min_password_length'])
+
+    if rules['uppercase'] > 0:
+        text += ''' Must include at least {} uppercase.'''.format(rules['uppercase'])
+    if rules['numbers'] > 0:
+        text += ''' Must include at least {} number{}.'''.format(rules['numbers'], plural(rules['numbers']))
+    if rules['lowercase'] > 0:
+        text += ''' Must include at least {} lowercase.'''.format(rules['lowercase'])
+    if rules['punctuation'] > 0:
+        text += ''' Must include at least {} punctuation character{}.'''.format(rules['punctuation'],
+                                                                               plural(rules['punctuation']))
+    if rules['username']:
+        text += ''' Cannot include your user name.'''
+    if rules['number_sequence']:
+        text += ''' Cannot include number sequences.'''
+    if rules['keyboard_sequence']:
+        text += ''' Cannot include keyboard letter sequences.'''
+    if rules['alphabet_sequence']:
+        text += ''' Cannot include alphabetic sequences.'''
+    if pwned_mode(rules) != 'off':
+        text += ''' Cannot be a pwned password.'''
+    if rules['passwords']:
+        text += ''' Cannot be like a common password.'''
+    if rules['dictionaries']:
+        text += ''' Cannot be like a banned password.'''
+    if rules['min_guesses']:
+        text += ''' Cannot be easy to guess.'''
+    if rules['long_password_override'] > 1:
+        text += ' Rules do not apply if password is greater than {} characters.'.format(
+            rules['long_password_override'] * rules['min_password_length'])
+    return text
+
+
+class RuleProfile:
+    """
+    The rules of one named profile and everything compiled from them: the
+    validator, strength estimator, rules text and JSON.  Immutable, so
+    update_rules replaces a profile with a new one and validations read
+    whichever profile was current when they started without locking.
+    """
+    __slots__ = ('name', 'rules', 'version', 'pwned_mode', 'estimator', 'validator', 'rules_text', 'rules_json')
+
+    def __init__(self, name, rules, version, common_passwords=None, dictionaries=None):
+        """
+        :param name: profile name
+        :param rules: complete rules dict, copied with list values such as dictionaries as tuples
+        :param version: number unique to this profile, part of the result cache keys
+        :param common_passwords: function returning the CommonPasswordMatcher of the rules
+        :param dictionaries: function returning the DictionaryIndex list of the rules
+        """
+        def setter(attribute, value):
+            object.__setattr__(self, attribute, value)
+
+        rules = freeze_rules(rules)
+        if pwned_mode(rules) not in PWNED_MODES:
+            raise ValueError('pwned rule must be one of {}'.format(', '.join(PWNED_MODES)))
+        if pwned_mode(rules) == 'local' and not rules['pwned_index']:
+            raise ValueError('pwned_index rule required for local pwned checking')
+        if rules['pwned_failure'] not in PWNED_FAILURES:
+            raise ValueError('pwned_failure rule must be one of {}'.format(', '.join(PWNED_FAILURES)))
+        setter('name', name)
+        setter('rules', rules)
+        setter('version', version)
+        setter('pwned_mode', pwned_mode(rules))
+        setter('estimator', StrengthEstimator(common_passwords, rules['keyboard_layouts']))
+        setter('validator', PasswordValidator(rules, common_passwords, dictionaries, self.estimator))
+        setter('rules_text', rules_text(rules))
+        body = json.dumps(dict((key, rules[key]) for key in CLIENT_RULES), sort_keys=True)
+        html_safe = body.replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026').replace(
+            "'", '\\u0027')
+        # (json of the CLIENT_RULES, html safe json, etag)
+        setter('rules_json', (body, html_safe, hashlib.sha256(body.encode()).hexdigest()[:16]))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('RuleProfile is immutable')
+
+    def __repr__(self):
+        return 'RuleProfile({!r}, version={})'.format(self.name, self.version)
@@ -0,0 +1,517 @@
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+PWNED_URL = 'https://api.pwnedpasswords.com/'
+
+DIGEST_SIZE = 20
+COUNT_FORMAT = '>I'
+RECORD_SIZE = DIGEST_SIZE + struct.calcsize(COUNT_FORMAT)
+MAX_COUNT = 2 ** 32 - 1
+# range suffixes are 35 hex characters, stored left padded to whole bytes
+SUFFIX_SIZE = 18
+
+
+class PwnedUnavailable(Exception):
+    """
+    the pwned service could not be checked: it failed, is too busy or its circuit breaker is open
+    """
+
+
+class _Flight:
+    """
+    a range fetch in progress that other lookups of the same prefix wait for
+    """
+    __slots__ = ('done', 'suffixes', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.suffixes = None
+        self.error = None
+
+    def wait(self, timeout):
+        if not self.done.wait(timeout):
+            raise PwnedUnavailable('pwned check timed out, try again')
+        if self.error is not None:
+            raise self.error
+        return self.suffixes
+
+
+class PwnedRange:
+    """
+    The suffixes of one range response in compact form: the sorted, fixed
+    width binary suffixes in one bytes object, found by binary search, and
+    their counts in an array.  About 22 bytes a suffix, where a dict of str
+    suffixes takes over 100.
+    """
+    __slots__ = ('_suffixes', '_counts')
+
+    def __init__(self, suffixes):
+        """
+        :param suffixes: iterable of (hex suffix, count)
+        """
+        records = sorted((bytes.fromhex(suffix.rjust(SUFFIX_SIZE * 2, '0')), min(count, MAX_COUNT))
+                         for suffix, count in suffixes)
+        self._suffixes = b''.join(suffix for suffix, count in records)
+        self._counts = array('I', [count for suffix, count in records])
+
+    def __len__(self):
+        return len(self._counts)
+
+    def get(self, suffix, default=0):
+        """
+        :param suffix: upper case hex hash suffix
+        :return: times the hash has been seen or default when it is not in the range
+        """
+        try:
+            key = bytes.fromhex(suffix.rjust(SUFFIX_SIZE * 2, '0'))
+        except ValueError:
+            return default
+        data = self._suffixes
+        low, high = 0, len(self._counts)
+        while low < high:
+            middle = (low + high) // 2
+            found = data[middle * SUFFIX_SIZE:(middle + 1) * SUFFIX_SIZE]
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return self._counts[middle]
+        return default
+
+
+def sha1_digest(password):
+    return hashlib.sha1(password.encode()).digest()
+
+
+def parse_pwned_line(line):
+    """
+    parse a HIBP format 'SHA1:count' line
+    :param line:
+    :return: (digest bytes, count) or None for blank lines
+    """
+    line = line.strip()
+    if not line:
+        return None
+    full_hash, _, count = line.partition(':')
+    return bytes.fromhex(full_hash), min(int(count or 1), MAX_COUNT)
+
+
+def _read_records(filename):
+    with open(filename, 'rb') as f:
+        while True:
+            record = f.read(RECORD_SIZE)
+            if len(record) < RECORD_SIZE:
+                return
+            yield record[:DIGEST_SIZE], struct.unpack(COUNT_FORMAT, record[DIGEST_SIZE:])[0]
+
+
+def build_pwned_index(source_filename, index_filename, min_count=0, chunk_size=1000000):
+    """
+    stream a HIBP 'SHA1:count' text dump into a sorted binary index of fixed
+    width records.  The dump is sorted in chunks of chunk_size lines which are
+    then merged, so it is never held in memory all at once.
+    :param source_filename: text dump, one SHA1:count per line
+    :param index_filename: binary index to write
+    :param min_count: skip hashes seen fewer than this many times
+    :param chunk_size: lines sorted in memory at a time
+    :return: number of records written
+    """
+    run_filenames = []
+    try:
+        with open(source_filename) as source:
+            chunk = []
+            for line in source:
+                record = parse_pwned_line(line)
+                if record is None or record[1] < min_count:
+                    continue
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    run_filenames.append(_write_run(chunk, os.path.dirname(os.path.abspath(index_filename))))
+                    chunk = []
+            if chunk or not run_filenames:
+                run_filenames.append(_write_run(chunk, os.path.dirname(os.path.abspath(index_filename))))
+
+        written = 0
+        previous = None
+        with open(index_filename, 'wb') as index:
+            for digest, count in heapq.merge(*[_read_records(filename) for filename in run_filenames]):
+                if digest == previous:
+                    continue
+                previous = digest
+                index.write(digest + struct.pack(COUNT_FORMAT, count))
+                written += 1
+        return written
+    finally:
+        for filename in run_filenames:
+            os.remove(filename)
+
+
+def _write_run(chunk, directory):
+    chunk.sort()
+    fd, filename = tempfile.mkstemp(suffix='.pwned-run', dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        for digest, count in chunk:
+            f.write(digest + struct.pack(COUNT_FORMAT, count))
+    return filename
+
+
+class LocalPwnedIndex:
+    """
+    Memory mapped, sorted index of SHA-1 digests built by build_pwned_index.
+    Membership is answered by a binary search over the fixed width records.
+    """
+
+    def __init__(self, filename, min_count=0):
+        self.filename = filename
+        self.min_count = min_count
+        self._file = open(filename, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size % RECORD_SIZE:
+            self._file.close()
+            raise ValueError('{} is not a pwned index'.format(filename))
+        self.records = size // RECORD_SIZE
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+
+    def __len__(self):
+        return self.records
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def count(self, digest):
+        """
+        :param digest: sha1 digest bytes
+        :return: times the digest has been seen, 0 when not present
+        """
+        data = self._map
+        low, high = 0, self.records
+        while low < high:
+            middle = (low + high) // 2
+            offset = middle * RECORD_SIZE
+            found = data[offset:offset + DIGEST_SIZE]
+            if found < digest:
+                low = middle + 1
+            elif found > digest:
+                high = middle
+            else:
+                return struct.unpack(COUNT_FORMAT, data[offset + DIGEST_SIZE:offset + RECORD_SIZE])[0]
+        return 0
+
+    def is_pwned(self, password):
+        count = self.count(sha1_digest(password))
+        return count > 0 and count >= self.min_count
+
+
+class PwnedClient:
+    """
+    Client for the HIBP k-anonymity range API.  Uses one pooled session with
+    explicit timeouts and keeps the parsed suffixes of recently fetched
+    prefixes in a bounded LRU cache that expires after ttl seconds.
+    Concurrent lookups of the same prefix share one fetch.
+
+    The asyncio lookups run the pooled session in the default executor.
+    Flask async views run every request on a new event loop, so an asyncio
+    http client could not keep its connections between requests.  Set
+    async_http when the lookups run on one long-lived event loop, such as
+    an ASGI server, to use an httpx.AsyncClient on that loop instead.
+    """
+
+    def __init__(self, url=PWNED_URL, connect_timeout=3.05, read_timeout=5, cache_size=1024, ttl=3600,
+                 pool_size=10, max_concurrent=0, queue_timeout=1.0, breaker=None, async_http=False):
+        """
+        :param max_concurrent: most lookups in flight at once, 0 for no limit
+        :param queue_timeout: seconds a lookup waits for a slot before failing, 0 to fail fast
+        :param breaker: optional CircuitBreaker that stops fetches while the service is failing.  Its
+            latency_budget, when set, also caps the connect and read timeouts.
+        :param async_http: asyncio lookups use httpx, one client per event loop, instead of the pooled session
+            in the default executor.  Requires httpx.
+        """
+        self.url = url
+        self.async_http = async_http
+        self.breaker = breaker
+        if breaker is not None and breaker.latency_budget > 0:
+            connect_timeout = min(connect_timeout, breaker.latency_budget)
+            read_timeout = min(read_timeout, breaker.latency_budget)
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._async_session = None
+        self._async_loop = None
+        self.pool_size = pool_size
+        self.queue_timeout = queue_timeout
+        self._in_flight = threading.BoundedSemaphore(max_concurrent) if max_concurrent > 0 else None
+        self.rejected = 0
+        self.fetches = 0
+        self.fetch_errors = 0
+        self.fetch_seconds = 0.0
+        self.coalesced = 0
+        self._flights = {}
+        self._async_flights = {}
+        self._session = None
+
+    @property
+    def session(self):
+        return self.get_session()
+
+    def get_session(self):
+        """
+        pooled requests.Session, created on first use so importing and
+        constructing the client does not import requests
+        """
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            with self._lock:
+                if self._session is None:
+                    self._session = session
+        return self._session
+
+    def stats(self):
+        stats = dict(hits=self.hits, misses=self.misses, size=len(self._cache), max_size=self.cache_size,
+                     rejected=self.rejected, fetches=self.fetches, fetch_errors=self.fetch_errors,
+                     fetch_seconds=self.fetch_seconds, coalesced=self.coalesced)
+        if self.breaker is not None:
+            stats.update(('circuit_{}'.format(name), value) for name, value in self.breaker.stats().items())
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def _cached(self, prefix):
+        with self._lock:
+            entry = self._cache.get(prefix)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(prefix)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._cache[prefix]
+            self.misses += 1
+            return None
+
+    def _store(self, prefix, suffixes):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[prefix] = (time.monotonic() + self.ttl, suffixes)
+            self._cache.move_to_end(prefix)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    @staticmethod
+    def parse_range(text):
+        """
+        :param text: range response body of SUFFIX:count lines
+        :return: PwnedRange of hash suffix to count
+        """
+        suffixes = []
+        for line in text.splitlines():
+            suffix, _, count = line.strip().partition(':')
+            if suffix:
+                suffixes.append((suffix, int(count or 1)))
+        return PwnedRange(suffixes)
+
+    def _acquire(self, blocking=True):
+        if self._in_flight is None:
+            return
+        if blocking and self.queue_timeout > 0:
+            acquired = self._in_flight.acquire(timeout=self.queue_timeout)
+        else:
+            acquired = self._in_flight.acquire(False)
+        if not acquired:
+            self.rejected += 1
+            raise PwnedUnavailable('too many pwned checks in progress, try again')
+
+    def _release(self):
+        if self._in_flight is not None:
+            self._in_flight.release()
+
+    def _begin(self, blocking=True):
+        """
+        wait for the circuit breaker and a slot before a fetch
+        :return: start time
+        """
+        if self.breaker is not None and not self.breaker.allow():
+            raise PwnedUnavailable('pwned checks are suspended, try again later')
+        self._acquire(blocking)
+        return time.monotonic()
+
+    def _end(self, start, ok):
+        seconds = time.monotonic() - start
+        self._release()
+        self.fetches += 1
+        self.fetch_seconds += seconds
+        if not ok:
+            self.fetch_errors += 1
+        if self.breaker is not None:
+            self.breaker.record(ok, seconds)
+
+    def _parse_response(self, response):
+        if response.status_code != 200:
+            raise PwnedUnavailable('pwned check failed with status {}, try again'.format(response.status_code))
+        return self.parse_range(response.content.decode('utf-8'))
+
+    def fetch_range(self, prefix):
+        start = self._begin()
+        ok = False
+        try:
+            response = self.session.get(self.url + 'range/' + prefix, timeout=self.timeout)
+            ok = response.status_code == 200
+        except Exception as e:
+            raise PwnedUnavailable('pwned check failed, try again') from e
+        finally:
+            self._end(start, ok)
+        return self._parse_response(response)
+
+    def get_range(self, prefix):
+        """
+        :param prefix: first 5 upper case hex characters of the sha1 hash
+        :return: PwnedRange of hash suffix to count.  Raises PwnedUnavailable when the service did not answer.
+        """
+        suffixes = self._cached(prefix)
+        if suffixes is not None:
+            return suffixes
+        with self._lock:
+            # a fetch may have finished since the cache was checked
+            entry = self._cache.get(prefix)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+            flight = self._flights.get(prefix)
+            leader = flight is None
+            if leader:
+                flight = self._flights[prefix] = _Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.wait(sum(self.timeout) + self.queue_timeout)
+        try:
+            flight.suffixes = self.fetch_range(prefix)
+            self._store(prefix, flight.suffixes)
+            return flight.suffixes
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[prefix]
+            flight.done.set()
+
+    def count(self, password):
+        """
+        :param password:
+        :return: times the password has been seen, 0 when not pwned.  Raises PwnedUnavailable when the service
+            did not answer.
+        """
+        full_hash = hashlib.sha1(password.encode()).hexdigest().upper()
+        return self.get_range(full_hash[:5]).get(full_hash[5:], 0)
+
+    def _get_async_session(self):
+        """
+        httpx.AsyncClient for the running event loop, or None when async_http is off.  The client of a previous
+        loop is closed on that loop when it is still running, a closed loop has already dropped its connections.
+        """
+        if not self.async_http:
+            return None
+        import asyncio
+
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if self._async_session is None or self._async_loop is not loop:
+            old_session, old_loop = self._async_session, self._async_loop
+            self._async_session = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(max_connections=self.pool_size))
+            self._async_loop = loop
+            if old_session is not None and old_loop.is_running():
+                asyncio.run_coroutine_threadsafe(old_session.aclose(), old_loop)
+        return self._async_session
+
+    async def fetch_range_async(self, prefix):
+        session = self._get_async_session()
+        if session is None:
+            import asyncio
+
+            # keep the blocking request off the event loop, the pooled session outlives the loop
+            return await asyncio.get_running_loop().run_in_executor(None, self.fetch_range, prefix)
+        # never block the event loop waiting for a slot
+        start = self._begin(blocking=False)
+        ok = False
+        try:
+            response = await session.get(self.url + 'range/' + prefix)
+            ok = response.status_code == 200
+        except Exception as e:
+            raise PwnedUnavailable('pwned check failed, try again') from e
+        finally:
+            self._end(start, ok)
+        return self._parse_response(response)
+
+    async def get_range_async(self, prefix):
+        import asyncio
+
+        if not self.async_http:
+            # get_range coalesces lookups across threads, and so across the event loop of each Flask async view
+            return await asyncio.get_running_loop().run_in_executor(None, self.get_range, prefix)
+        suffixes = self._cached(prefix)
+        if suffixes is not None:
+            return suffixes
+        loop = asyncio.get_running_loop()
+        flight = self._async_flights.get(prefix)
+        if flight is not None and flight.get_loop() is loop:
+            self.coalesced += 1
+            # a cancelled waiter must not cancel the fetch the others wait for
+            return await asyncio.shield(flight)
+        flight = self._async_flights[prefix] = loop.create_future()
+        try:
+            suffixes = await self.fetch_range_async(prefix)
+            self._store(prefix, suffixes)
+            flight.set_result(suffixes)
+            return suffixes
+        except Exception as e:
+            flight.set_exception(e)
+            # retrieved, so there is no warning when nobody else was waiting
+            flight.exception()
+            raise
+        finally:
+            if self._async_flights.get(prefix) is flight:
+                del self._async_flights[prefix]
+            if not flight.done():
+                flight.cancel()
+
+    async def count_async(self, password):
+        """
+        asyncio version of count
+        """
+        full_hash = hashlib.sha1(password.encode()).hexdigest().upper()
+        suffixes = await self.get_range_async(full_hash[:5])
+        return suffixes.get(full_hash[5:], 0)
+
+    async def aclose(self):
+        """
+        close the httpx client of the running event loop
+        """
+        if self._async_session is not None:
+            await self._async_session.aclose()
+            self._async_session = None
+            self._async_loop = None
@@ -0,0 +1,71 @@
+import threading
+import time
+
+
+class MemoryTokenStore:
+    """
+    In process token buckets for a single process server.  Multi-worker
+    deployments can supply any object with the same take method backed by
+    shared storage, such as redis.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, burst, rate, count=1):
+        """
+        take tokens from the bucket of key
+        :param key: client key
+        :param burst: bucket size
+        :param rate: tokens added per second
+        :param count: tokens to take
+        :return: True when count tokens were available
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            allowed = tokens >= count
+            self._buckets[key] = (tokens - count if allowed else tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now, burst, rate)
+            return allowed
+
+    def _prune(self, now, burst, rate):
+        # full buckets hold no state worth keeping
+        for key, (tokens, last) in list(self._buckets.items()):
+            if tokens + (now - last) * rate >= burst:
+                del self._buckets[key]
+
+
+class RateLimiter:
+    """
+    Token bucket limits per client IP address and per session
+    """
+
+    def __init__(self, burst=10, rate=2.0, store=None):
+        """
+        :param burst: requests a client can make at once
+        :param rate: requests per second a client can sustain
+        :param store: token store, default is MemoryTokenStore
+        """
+        self.burst = burst
+        self.rate = rate
+        self.store = store or MemoryTokenStore()
+        self.limited = 0
+
+    def allow(self, keys, count=1):
+        """
+        :param keys: client keys, such as the IP address and session
+        :param count: tokens the request costs, one per password checked
+        :return: True when every key has count tokens
+        """
+        # stores written for single tokens take three arguments
+        extra = (count,) if count != 1 else ()
+        for key in keys:
+            if key and not self.store.take(key, self.burst, self.rate, *extra):
+                self.limited += 1
+                return False
+        return True
@@ -0,0 +1,61 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Short lived, bounded cache of password check results.  Keys are an HMAC
+    of the password, username and rules version with a per-process secret,
+    so no plaintext password is held.
+    """
+
+    def __init__(self, size=1024, ttl=30):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._secret = os.urandom(32)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, password, username, rules_version):
+        message = '\0'.join([password, username or '', str(rules_version)]).encode('utf-8', 'surrogatepass')
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def get(self, key):
+        """
+        :return: (True, result) or (False, None) when not cached
+        """
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._cache[key]
+                self.evictions += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, result):
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.size:
+                self._cache.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, size=len(self._cache),
+                    max_size=self.size, hit_rate=self.hits / float(lookups) if lookups else 0.0)
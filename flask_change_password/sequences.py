@@ -0,0 +1,68 @@
+LAYOUTS = {
+    'alphabet': ('abcdefghijklmnopqrstuvwxyz',),
+    'digits': ('0123456789',),
+    'qwerty': ('qwertyuiop[]', "asdfghjkl;'", 'zxcvbnm,./'),
+    'qwertz': ('qwertzuiop', 'asdfghjkl', 'yxcvbnm'),
+    'azerty': ('azertyuiop', 'qsdfghjklm', 'wxcvbn'),
+    'numpad': ('789', '456', '123', '7410', '8520', '963'),
+}
+
+
+def register_layout(name, rows):
+    """
+    add or replace a named adjacency table
+    :param name: layout name used in rules
+    :param rows: strings of adjacent characters in ascending order
+    """
+    LAYOUTS[name] = tuple(rows)
+
+
+def adjacency_table(rows):
+    """
+    :param rows: strings of adjacent characters
+    :return: dict of character to the characters that follow it
+    """
+    successors = {}
+    for row in rows:
+        for x in range(len(row) - 1):
+            successors[row[x]] = successors.get(row[x], '') + row[x + 1]
+    return successors
+
+
+class SequenceScanner:
+    """
+    find ascending, and optionally descending, runs of run_length adjacent
+    characters over one or more layouts in a single pass over the password
+    """
+    __slots__ = ('tables', 'run_length', 'descending')
+
+    def __init__(self, layouts, run_length, descending=False):
+        """
+        :param layouts: layout names from LAYOUTS or lists of row strings
+        :param run_length: shortest run reported
+        :param descending: also report descending runs
+        """
+        self.tables = tuple(adjacency_table(LAYOUTS[layout] if isinstance(layout, str) else layout)
+                            for layout in layouts)
+        self.run_length = max(2, run_length)
+        self.descending = descending
+
+    def find(self, password):
+        """
+        :return: the first run found in password or None
+        """
+        run_length = self.run_length
+        tables = self.tables
+        ascending = [1] * len(tables)
+        descending = [1] * len(tables)
+        previous = None
+        for position, c in enumerate(password):
+            if previous is not None:
+                for x, successors in enumerate(tables):
+                    ascending[x] = ascending[x] + 1 if c in successors.get(previous, '') else 1
+                    if self.descending:
+                        descending[x] = descending[x] + 1 if previous in successors.get(c, '') else 1
+                    if ascending[x] >= run_length or descending[x] >= run_length:
+                        return password[position - run_length + 1:position + 1]
+            previous = c
+        return None
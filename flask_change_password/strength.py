@@ -0,0 +1,445 @@
+"""
+Password strength estimation in the style of zxcvbn.
+
+The password is searched for dictionary words, keyboard patterns, repeats,
+sequences and dates, each match with an estimate of the guesses an attacker
+needs to find it.  A dynamic program then picks the sequence of matches,
+with brute force filling the gaps, that needs the fewest guesses in total.
+"""
+import datetime
+import math
+import re
+import unicodedata
+
+from .sequences import LAYOUTS
+from .validator import LEET_TABLE
+
+BRUTEFORCE_CARDINALITY = 10
+MIN_GUESSES_BEFORE_GROWING_SEQUENCE = 10000
+MIN_SUBMATCH_GUESSES_SINGLE_CHAR = 10
+MIN_SUBMATCH_GUESSES_MULTI_CHAR = 50
+MIN_YEAR_SPACE = 20
+REFERENCE_YEAR = datetime.date.today().year
+DATE_MIN_YEAR = 1000
+DATE_MAX_YEAR = 2050
+# ways to split 4 to 8 digits into day, month and year
+DATE_SPLITS = {4: ((1, 2), (2, 3)), 5: ((1, 3), (2, 3)), 6: ((1, 2), (2, 4), (4, 5)),
+               7: ((1, 3), (2, 3), (4, 5), (4, 6)), 8: ((2, 4), (4, 6))}
+# guesses below each threshold get the score of its position, above them all 4
+SCORE_THRESHOLDS = (1e3 + 5, 1e6 + 5, 1e8 + 5, 1e10 + 5)
+# longer passwords are estimated on this many characters
+MAX_LENGTH = 64
+# brute force runs start after one of the nearest this many pattern ends, which bounds the work per character
+MAX_PATTERN_ENDS = 8
+# sequences start with one of these often enough to need fewer guesses
+OBVIOUS_STARTS = 'aAzZ019'
+MAX_SEQUENCE_DELTA = 5
+
+DIGITS_RE = re.compile(r'\d{4,8}')
+SEPARATED_DATE_RE = re.compile(r'(\d{1,4})([\s/\\_.-])(\d{1,2})\2(\d{1,4})')
+RECENT_YEAR_RE = re.compile(r'19\d\d|20\d\d')
+GREEDY_REPEAT_RE = re.compile(r'(.+)\1+')
+LAZY_REPEAT_RE = re.compile(r'(.+?)\1+')
+REPEAT_BASE_RE = re.compile(r'^(.+?)\1+$')
+
+
+class Match:
+    __slots__ = ('pattern', 'i', 'j', 'token', 'guesses')
+
+    def __init__(self, pattern, i, j, token, guesses):
+        """
+        :param pattern: dictionary, spatial, repeat, sequence, date or bruteforce
+        :param i: first character position
+        :param j: last character position, inclusive
+        :param token: the matched part of the password
+        :param guesses: estimated guesses to find the token
+        """
+        self.pattern = pattern
+        self.i = i
+        self.j = j
+        self.token = token
+        self.guesses = guesses
+
+    def __repr__(self):
+        return 'Match({!r}, {}, {}, {!r}, {})'.format(self.pattern, self.i, self.j, self.token, self.guesses)
+
+
+class Estimate:
+    __slots__ = ('guesses', 'score', 'sequence')
+
+    def __init__(self, guesses, sequence):
+        self.guesses = guesses
+        self.score = guesses_to_score(guesses)
+        self.sequence = sequence
+
+    @property
+    def guesses_log10(self):
+        return math.log10(self.guesses)
+
+    def __repr__(self):
+        return 'Estimate(guesses={:.4g}, score={})'.format(self.guesses, self.score)
+
+
+def guesses_to_score(guesses):
+    """
+    :return: 0, too guessable, to 4, very unguessable
+    """
+    for score, threshold in enumerate(SCORE_THRESHOLDS):
+        if guesses < threshold:
+            return score
+    return len(SCORE_THRESHOLDS)
+
+
+def uppercase_variations(token):
+    if token.islower() or not any(c.isupper() for c in token):
+        return 1
+    # capitalized, all caps and only the last letter upper case are common
+    if token[0].isupper() and token[1:].islower() or token.isupper() or \
+            token[-1].isupper() and token[:-1].islower():
+        return 2
+    upper = sum(1 for c in token if c.isupper())
+    lower = sum(1 for c in token if c.islower())
+    return sum(math.comb(upper + lower, x) for x in range(1, min(upper, lower) + 1))
+
+
+def l33t_variations(token, plain):
+    """
+    :param token: matched characters as typed, lower case
+    :param plain: the same characters with substitutions undone
+    """
+    variations = 1
+    substitutions = set((c, p) for c, p in zip(token, plain) if c != p)
+    for substituted, letter in substitutions:
+        subbed = sum(1 for c, p in zip(token, plain) if c == substituted and p == letter)
+        unsubbed = sum(1 for c in token if c == letter)
+        if not unsubbed:
+            variations *= 2
+        else:
+            variations *= sum(math.comb(subbed + unsubbed, x) for x in range(1, min(subbed, unsubbed) + 1))
+    return variations
+
+
+def _keyboard_graph(rows):
+    """
+    :return: dict of key to a dict of the keys either side of it and the direction, -1 or 1, to them
+    """
+    graph = {}
+    for row in rows:
+        for x, c in enumerate(row):
+            neighbours = graph.setdefault(c, {})
+            if x > 0:
+                neighbours[row[x - 1]] = -1
+            if x + 1 < len(row):
+                neighbours[row[x + 1]] = 1
+    return graph
+
+
+def _two_to_four_digit_year(year):
+    if year > 99:
+        return year
+    if year > 50:
+        return year + 1900
+    return year + 2000
+
+
+def _day_month(values):
+    for day, month in (values, values[::-1]):
+        if 1 <= day <= 31 and 1 <= month <= 12:
+            return day, month
+    return None
+
+
+def date_year(values):
+    """
+    :param values: three integers in the order written
+    :return: the year when they can be a date, otherwise None
+    """
+    if values[1] > 31 or values[1] <= 0:
+        return None
+    over_12 = over_31 = under_1 = 0
+    for value in values:
+        if 99 < value < DATE_MIN_YEAR or value > DATE_MAX_YEAR:
+            return None
+        over_31 += value > 31
+        over_12 += value > 12
+        under_1 += value <= 0
+    if over_31 >= 2 or over_12 == 3 or under_1 >= 2:
+        return None
+    year_splits = ((values[2], values[:2]), (values[0], values[1:]))
+    for year, rest in year_splits:
+        if DATE_MIN_YEAR <= year <= DATE_MAX_YEAR and _day_month(rest):
+            return year
+    for year, rest in year_splits:
+        if year <= 99 and _day_month(rest):
+            return _two_to_four_digit_year(year)
+    return None
+
+
+def _year_space(year):
+    return max(abs(year - REFERENCE_YEAR), MIN_YEAR_SPACE)
+
+
+class StrengthEstimator:
+    """
+    Estimate the guesses needed to find a password.  Dictionary words are
+    ranked by their position in a frequency ordered password list.
+    """
+
+    def __init__(self, common_passwords, keyboard_layouts=('qwerty', 'qwertz', 'azerty', 'numpad')):
+        """
+        :param common_passwords: function returning the CommonPasswordMatcher of the ranked password list
+        :param keyboard_layouts: layout names from LAYOUTS or lists of row strings
+        """
+        self.common_passwords = common_passwords
+        self.keyboards = []
+        for layout in keyboard_layouts:
+            graph = _keyboard_graph(LAYOUTS[layout] if isinstance(layout, str) else layout)
+            degree = sum(len(neighbours) for neighbours in graph.values()) / float(len(graph) or 1)
+            self.keyboards.append((graph, len(graph), degree))
+
+    def estimate(self, password, user_inputs=()):
+        """
+        :param password:
+        :param user_inputs: words such as the user name that count as the most common password
+        :return: Estimate
+        """
+        password = password[:MAX_LENGTH]
+        if not password.isascii():
+            password = unicodedata.normalize('NFKC', password)
+        if not password:
+            return Estimate(1, [])
+        lower = password.lower()
+        if len(lower) != len(password):
+            lower = password
+        return self._most_guessable(password, self.matches(password, lower, user_inputs))
+
+    def matches(self, password, lower, user_inputs=()):
+        """
+        :return: list of every Match found in password
+        """
+        matches = self.dictionary_matches(password, lower, user_inputs)
+        matches.extend(self.spatial_matches(lower))
+        matches.extend(self.repeat_matches(password))
+        matches.extend(self.sequence_matches(password))
+        matches.extend(self.date_matches(password))
+        return matches
+
+    def dictionary_matches(self, password, lower, user_inputs=()):
+        matcher = self.common_passwords()
+        plain = lower.translate(LEET_TABLE)
+        found = {}
+        for candidate in set([lower, plain]):
+            for i, j, index in matcher.matches(candidate):
+                rank = index + 1
+                if rank < found.get((i, j), (rank + 1,))[0]:
+                    found[(i, j)] = (rank, candidate)
+        for user_input in user_inputs:
+            user_input = user_input.lower().translate(LEET_TABLE)
+            if not user_input:
+                continue
+            start = plain.find(user_input)
+            while start >= 0:
+                found[(start, start + len(user_input) - 1)] = (1, plain)
+                start = plain.find(user_input, start + 1)
+        matches = []
+        for (i, j), (rank, candidate) in found.items():
+            token = password[i:j + 1]
+            guesses = rank * uppercase_variations(token)
+            if candidate is plain:
+                guesses *= l33t_variations(lower[i:j + 1], plain[i:j + 1])
+            matches.append(Match('dictionary', i, j, token, guesses))
+        return matches
+
+    def spatial_matches(self, lower):
+        """
+        runs of three or more adjacent keys, turning any number of times
+        """
+        matches = []
+        for graph, starting_positions, degree in self.keyboards:
+            i = 0
+            while i < len(lower) - 2:
+                j = i + 1
+                turns = 0
+                direction = None
+                while j < len(lower):
+                    step = graph.get(lower[j - 1], {}).get(lower[j])
+                    if step is None:
+                        break
+                    if direction is not None and step != direction:
+                        turns += 1
+                    direction = step
+                    j += 1
+                if j - i > 2:
+                    matches.append(Match('spatial', i, j - 1, lower[i:j],
+                                         self.spatial_guesses(j - i, turns + 1, starting_positions, degree)))
+                    i = j - 1
+                else:
+                    i += 1
+        return matches
+
+    @staticmethod
+    def spatial_guesses(length, turns, starting_positions, degree):
+        guesses = 0
+        for x in range(2, length + 1):
+            for y in range(1, min(turns, x - 1) + 1):
+                guesses += math.comb(x - 1, y - 1) * starting_positions * degree ** y
+        return guesses
+
+    def repeat_matches(self, password):
+        matches = []
+        position = 0
+        while position < len(password):
+            greedy = GREEDY_REPEAT_RE.search(password, position)
+            if greedy is None:
+                break
+            lazy = LAZY_REPEAT_RE.search(password, position)
+            if len(greedy.group(0)) > len(lazy.group(0)):
+                match = greedy
+                base = REPEAT_BASE_RE.match(match.group(0)).group(1)
+            else:
+                match = lazy
+                base = lazy.group(1)
+            i, j = match.start(), match.end() - 1
+            base_guesses = self._most_guessable(base, self.matches(base, base.lower())).guesses
+            matches.append(Match('repeat', i, j, match.group(0), base_guesses * (len(match.group(0)) // len(base))))
+            position = j + 1
+        return matches
+
+    @staticmethod
+    def sequence_guesses(token, ascending):
+        if token[0] in OBVIOUS_STARTS:
+            base = 4
+        elif token[0].isdigit():
+            base = 10
+        else:
+            base = 26
+        return base * len(token) * (1 if ascending else 2)
+
+    def sequence_matches(self, password):
+        matches = []
+        if len(password) < 3:
+            return matches
+
+        def add(i, j, delta):
+            if j - i >= 2 and 0 < abs(delta) <= MAX_SEQUENCE_DELTA:
+                token = password[i:j + 1]
+                matches.append(Match('sequence', i, j, token, self.sequence_guesses(token, delta > 0)))
+
+        i = 0
+        last_delta = None
+        for k in range(1, len(password)):
+            delta = ord(password[k]) - ord(password[k - 1])
+            if last_delta is None:
+                last_delta = delta
+            if delta == last_delta:
+                continue
+            add(i, k - 1, last_delta)
+            i = k - 1
+            last_delta = delta
+        add(i, len(password) - 1, last_delta)
+        return matches
+
+    @staticmethod
+    def date_matches(password):
+        matches = []
+        for match in RECENT_YEAR_RE.finditer(password):
+            matches.append(Match('date', match.start(), match.end() - 1, match.group(0),
+                                 _year_space(int(match.group(0)))))
+        # dates without separators are found in every run of 4 to 8 digits
+        for run in DIGITS_RE.finditer(password):
+            digits = run.group(0)
+            for i in range(len(digits)):
+                for j in range(i + 4, min(len(digits), i + 8) + 1):
+                    token = digits[i:j]
+                    years = [date_year((int(token[:k]), int(token[k:l]), int(token[l:])))
+                             for k, l in DATE_SPLITS[len(token)]]
+                    years = [year for year in years if year is not None]
+                    if years:
+                        year = min(years, key=lambda year: abs(year - REFERENCE_YEAR))
+                        matches.append(Match('date', run.start() + i, run.start() + j - 1, token,
+                                             _year_space(year) * 365))
+        for position in range(len(password)):
+            match = SEPARATED_DATE_RE.match(password, position)
+            if match is None:
+                continue
+            year = date_year((int(match.group(1)), int(match.group(3)), int(match.group(4))))
+            if year is not None:
+                matches.append(Match('date', match.start(), match.end() - 1, match.group(0),
+                                     _year_space(year) * 365 * 4))
+        return matches
+
+    @staticmethod
+    def _bruteforce(password, i, j):
+        return Match('bruteforce', i, j, password[i:j + 1], BRUTEFORCE_CARDINALITY ** (j - i + 1))
+
+    def _most_guessable(self, password, matches):
+        """
+        pick the sequence of non overlapping matches, with brute force in the
+        gaps, that needs the fewest guesses.  A sequence of l matches needs
+        l! times the product of their guesses, plus a penalty for each match.
+        :return: Estimate
+        """
+        n = len(password)
+        if not matches:
+            return Estimate(BRUTEFORCE_CARDINALITY ** n, [self._bruteforce(password, 0, n - 1)])
+        by_end = [[] for _ in range(n)]
+        for match in matches:
+            # any part of a longer password needs some guessing
+            if match.j - match.i + 1 < n:
+                minimum = MIN_SUBMATCH_GUESSES_SINGLE_CHAR if match.i == match.j else MIN_SUBMATCH_GUESSES_MULTI_CHAR
+                match.guesses = max(match.guesses, minimum)
+            by_end[match.j].append(match)
+        # for each end position, by sequence length: product of guesses, total guesses and last match
+        optimal_pi = [{} for _ in range(n)]
+        optimal_g = [{} for _ in range(n)]
+        optimal_match = [{} for _ in range(n)]
+        # end positions with a best sequence ending in a match other than brute force
+        pattern_ends = []
+        # brute force of the whole password is always possible, and extending a sequence never needs fewer guesses
+        upper_bound = BRUTEFORCE_CARDINALITY ** n + 1
+
+        def update(match, length):
+            k = match.j
+            pi = match.guesses
+            if length > 1:
+                pi *= optimal_pi[match.i - 1][length - 1]
+            g = math.factorial(length) * pi + MIN_GUESSES_BEFORE_GROWING_SEQUENCE ** (length - 1)
+            if g > upper_bound:
+                return
+            # a sequence as short and at least as good has already been found
+            for competing_length, competing_g in optimal_g[k].items():
+                if competing_length <= length and competing_g <= g:
+                    return
+            optimal_g[k][length] = g
+            optimal_pi[k][length] = pi
+            optimal_match[k][length] = match
+
+        for k in range(n):
+            for match in by_end[k]:
+                if match.i > 0:
+                    for length in list(optimal_match[match.i - 1]):
+                        update(match, length + 1)
+                else:
+                    update(match, 1)
+            if any(match.pattern != 'bruteforce' for match in optimal_match[k].values()):
+                pattern_ends.append(k)
+            # brute force from the start, or from after the end of another pattern
+            update(self._bruteforce(password, 0, k), 1)
+            for end in pattern_ends[-MAX_PATTERN_ENDS - 1:]:
+                if end >= k:
+                    break
+                match = self._bruteforce(password, end + 1, k)
+                for length, last_match in list(optimal_match[end].items()):
+                    if last_match.pattern != 'bruteforce':
+                        update(match, length + 1)
+
+        length, guesses = min(optimal_g[n - 1].items(), key=lambda item: item[1])
+        sequence = []
+        k = n - 1
+        while k >= 0:
+            match = optimal_match[k][length]
+            sequence.append(match)
+            k = match.i - 1
+            length -= 1
+        sequence.reverse()
+        return Estimate(guesses, sequence)
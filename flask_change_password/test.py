@@ -1,8 +1,32 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer, ThreadingHTTPServer
 
 from flask import Flask, render_template_string, request
 
+from flask_change_password import benchmark
+from flask_change_password.bloom import BloomFilter, benchmark_bloom_filter
+from flask_change_password.circuit_breaker import CircuitBreaker
+from flask_change_password.common_passwords import COMMON_PASSWORDS_FILE, CommonPasswordMatcher, MappedPasswordMatcher
 from flask_change_password.flask_change_password import ChangePassword, ChangePasswordForm
+from flask_change_password.dictionary import DictionaryIndex, build_dictionary
+from flask_change_password.live import LiveChannel
+from flask_change_password.validator import PasswordValidator, ValidationResult, count_character_classes, normalize
+from flask_change_password.metrics import Metrics
+from flask_change_password.rate_limit import MemoryTokenStore, RateLimiter
+from flask_change_password.result_cache import ResultCache
+from flask_change_password.sequences import SequenceScanner, register_layout
+from flask_change_password.strength import MAX_LENGTH, StrengthEstimator, date_year, guesses_to_score
+from flask_change_password.pwned import LocalPwnedIndex, PwnedClient, PwnedUnavailable, build_pwned_index, sha1_digest
 
 
 class AppTestCase(unittest.TestCase):
@@ -144,6 +168,1145 @@ class AppTestCase(unittest.TestCase):
         assert result == '', result
 
 
+class BenchmarkTestCase(unittest.TestCase):
+    def test_run(self):
+        results = benchmark.run(number=2, repeat=2)
+        names = set(result['name'] for result in results['benchmarks'])
+        assert names == {'password_good_enough', 'normalize', 'estimate_strength', 'common_passwords',
+                         'number_sequences', 'alphabet_sequences', 'keyboard_sequences', 'check_pwned',
+                         'change_password_template'}, names
+        assert all(result['min'] > 0 for result in results['benchmarks'])
+
+
+class ImportTestCase(unittest.TestCase):
+    # generous, importing flask alone takes most of it
+    IMPORT_BUDGET = 2.0
+
+    def test_import_is_lazy(self):
+        code = ('import sys, time\n'
+                'start = time.perf_counter()\n'
+                'import flask_change_password\n'
+                'elapsed = time.perf_counter() - start\n'
+                'print(elapsed)\n'
+                'print(" ".join(m for m in ("requests", "wtforms", "flask_wtf", "asyncio", "concurrent.futures") '
+                'if m in sys.modules))\n')
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=root).decode().splitlines()
+        assert float(output[0]) < self.IMPORT_BUDGET, output
+        assert len(output) == 1 or not output[1].strip(), output
+
+    def test_warmup(self):
+        app = Flask(__name__)
+        change_password = ChangePassword(min_password_length=10, rules=dict(pwned=False))
+        change_password.init_app(app, warmup=True)
+        assert change_password.common_passwords is not None
+        assert change_password.assets is not None
+        from flask_change_password import SetPasswordForm
+        assert SetPasswordForm.__module__ == 'flask_change_password.forms'
+
+
+class RateLimitTestCase(unittest.TestCase):
+    def test_token_bucket(self):
+        store = MemoryTokenStore()
+        assert store.take('a', 2, 100)
+        assert store.take('a', 2, 100)
+        assert not store.take('a', 2, 100)
+        time.sleep(0.02)
+        assert store.take('a', 2, 100)
+
+    def test_take_count(self):
+        store = MemoryTokenStore()
+        assert store.take('a', 5, 0.001, 4)
+        assert not store.take('a', 5, 0.001, 2)
+        assert store.take('a', 5, 0.001)
+
+    def test_prune(self):
+        store = MemoryTokenStore(max_keys=2)
+        for key in ['a', 'b', 'c']:
+            store.take(key, 1, 1000)
+        time.sleep(0.01)
+        store.take('d', 1, 1000)
+        assert len(store._buckets) <= 2, store._buckets
+
+
+class PasswordValidatorTestCase(unittest.TestCase):
+    def test_update_rules_compiles(self):
+        change_password = ChangePassword(min_password_length=8)
+        validator = change_password.validator
+        assert isinstance(validator, PasswordValidator)
+        change_password.update_rules(dict(uppercase=3))
+        assert change_password.validator is not validator
+        assert change_password.validator.uppercase == 3
+        assert validator.uppercase == 1
+
+    def test_immutable(self):
+        validator = ChangePassword(min_password_length=8).validator
+        with self.assertRaises(AttributeError):
+            validator.uppercase = 0
+
+    def test_count_character_classes(self):
+        assert count_character_classes('AbC12#$%') == [2, 1, 2, 3]
+
+    def test_first_sequence_reported(self):
+        sequence = ChangePassword().validator.number_sequences.find('x789x123')
+        assert sequence == '789', sequence
+
+
+class ValidationResultTestCase(unittest.TestCase):
+    def setUp(self):
+        self.change_password = ChangePassword(min_password_length=8, rules=dict(pwned='off'))
+
+    def test_valid(self):
+        result = self.change_password.validate('ru%d*ebo#Ay1!', 'Numbers')
+        assert result.valid and result.score == 5, result
+        assert result.to_dict() == dict(valid=True, score=5, failures=[])
+
+    def test_fast_fail(self):
+        result = self.change_password.validate('password')
+        assert not result and result.score == 0, result
+        assert result.rules == ['uppercase'], result.rules
+
+    def test_collect_all(self):
+        result = self.change_password.validate('password', collect_all=True)
+        assert result.rules == ['uppercase', 'numbers', 'punctuation', 'passwords'], result.rules
+        assert len(set(result.messages)) == 4, result.messages
+        result = self.change_password.validate('tiny', collect_all=True)
+        assert result.rules[0] == 'min_password_length', result.rules
+
+    def test_no_exceptions(self):
+        assert self.change_password.valid_password('password') == self.change_password.validate('password').messages[0]
+        with self.assertRaises(Exception):
+            self.change_password.password_good_enough('password')
+
+    def test_pwned_failure(self):
+        index_fd, index_filename = tempfile.mkstemp()
+        os.close(index_fd)
+        source_fd, source_filename = tempfile.mkstemp()
+        with os.fdopen(source_fd, 'w') as source:
+            source.write('{}:5\n'.format(hashlib.sha1(b'ru%d*ebo#Ay1!').hexdigest().upper()))
+        try:
+            build_pwned_index(source_filename, index_filename)
+            self.change_password.update_rules(dict(pwned='local', pwned_index=index_filename))
+            result = self.change_password.validate('ru%d*ebo#Ay1!')
+            assert result.rules == ['pwned'] and result.score == 0, result
+        finally:
+            self.change_password.update_rules(dict(pwned='off'))
+            os.remove(index_filename)
+            os.remove(source_filename)
+
+    def test_username(self):
+        assert self.change_password.validate_username('test.user').valid
+        result = self.change_password.validate_username('.u', collect_all=True)
+        assert result.rules == ['invalid_username', 'not_start_end_with_dot'], result.rules
+        assert result.score is None
+        assert self.change_password.valid_username('.u') == result.messages[0]
+
+    def test_repr(self):
+        assert repr(ValidationResult(3)) == 'ValidationResult(score=3, failures=[])'
+
+
+class RuleProfileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.change_password = ChangePassword(min_password_length=8, rules=dict(pwned='off'),
+                                              result_cache=ResultCache(size=16, ttl=60))
+        self.change_password.update_rules(dict(uppercase=3), profile='strict')
+
+    def test_profiles(self):
+        assert self.change_password.valid_password('alllowercase1!') == '1 uppercase required'
+        assert self.change_password.valid_password('alllowercase1!', profile='strict') == '3 uppercase required'
+        assert self.change_password.get_profile('strict').rules['pwned'] == 'off'
+        assert 'at least 3 uppercase' in self.change_password.get_rules_text('strict')
+        with self.assertRaises(ValueError):
+            self.change_password.valid_password('alllowercase1!', profile='missing')
+        self.change_password.remove_profile('strict')
+        assert 'strict' not in self.change_password.profiles
+        with self.assertRaises(ValueError):
+            self.change_password.remove_profile('default')
+
+    def test_copy_on_write(self):
+        rules = self.change_password.rules
+        profile = self.change_password.get_profile()
+        self.change_password.update_rules(dict(uppercase=2))
+        assert rules['uppercase'] == 1
+        assert self.change_password.get_profile() is not profile
+        with self.assertRaises(TypeError):
+            rules['uppercase'] = 5
+        with self.assertRaises(AttributeError):
+            profile.rules = {}
+        # list values are frozen too
+        with self.assertRaises(AttributeError):
+            rules['keyboard_layouts'].append('dvorak')
+        layouts = [['135', '79']]
+        self.change_password.update_rules(dict(keyboard_layouts=layouts))
+        layouts[0].append('28')
+        assert self.change_password.rules['keyboard_layouts'] == (('135', '79'),)
+
+    def test_shared_resources(self):
+        common_passwords = self.change_password.get_common_passwords('strict')
+        assert self.change_password.get_common_passwords() is common_passwords
+        self.change_password.update_rules(dict(numbers=2), profile='strict')
+        assert self.change_password.get_common_passwords('strict') is common_passwords
+
+    def test_concurrent_updates(self):
+        results = set()
+        stop = threading.Event()
+
+        def validate():
+            while not stop.is_set():
+                results.add(self.change_password.valid_password('alllowercase1!'))
+
+        thread = threading.Thread(target=validate)
+        thread.start()
+        for uppercase in [2, 1] * 20:
+            self.change_password.update_rules(dict(uppercase=uppercase))
+        stop.set()
+        thread.join()
+        assert results <= {'1 uppercase required', '2 uppercase required'}, results
+
+    def test_routes(self):
+        app = Flask(__name__)
+        app.testing = True
+        self.change_password.init_app(app)
+        client = app.test_client()
+        assert client.get('/flask_change_password/get_rules?profile=strict').json['uppercase'] == 3
+        assert client.get('/flask_change_password/get_rules').json['uppercase'] == 1
+        assert client.get('/flask_change_password/get_rules?profile=missing').status_code == 404
+        result = client.post('/flask_change_password/check_password',
+                             json=dict(password='alllowercase1!', profile='strict'))
+        assert result.data.decode('utf-8') == '3 uppercase required', result.data
+
+
+class LiveConnection:
+    """
+    in memory stand in for a WebSocket with the messages already sent by the page
+    """
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = []
+
+    def receive(self, timeout):
+        if self.messages:
+            return self.messages.pop(0)
+        if timeout is None:
+            raise EOFError
+        return None
+
+    def send(self, text):
+        self.sent.append(json.loads(text))
+
+
+class LiveChannelTestCase(unittest.TestCase):
+    def setUp(self):
+        self.change_password = ChangePassword(min_password_length=8, rules=dict(pwned='off'))
+
+    def serve(self, *messages):
+        connection = LiveConnection(json.dumps(message) if isinstance(message, dict) else message
+                                    for message in messages)
+        channel = LiveChannel(self.change_password, connection.receive, connection.send)
+        channel.serve()
+        return channel, connection.sent
+
+    def test_superseded_dropped(self):
+        channel, sent = self.serve(dict(id=1, password='t'), dict(id=2, password='ti'), dict(id=3, password='tiny'))
+        assert [answer['id'] for answer in sent] == [3], sent
+        assert sent[0]['failures'][0]['rule'] == 'min_password_length', sent
+        assert channel.dropped == 2 and channel.answered == 1
+
+    def test_answer(self):
+        channel, sent = self.serve(dict(id=7, password='ru%d*ebo#Ay1!', username='Numbers'))
+        assert sent == [dict(id=7, valid=True, score=5, failures=[])], sent
+
+    def test_profile(self):
+        self.change_password.update_rules(dict(uppercase=3), profile='strict')
+        answer = self.change_password.validate('alllowercase1!', profile='strict').to_dict()
+        assert self.serve(dict(id=1, password='alllowercase1!', profile='strict'))[1] == [dict(answer, id=1)]
+        assert self.serve(dict(id=1, password='x', profile='missing'))[1] == [
+            dict(id=1, error='unknown rule profile')]
+
+    def test_invalid_message(self):
+        assert self.serve('not json')[1] == [dict(id=None, error='invalid check message')]
+
+    def test_template(self):
+        app = Flask(__name__)
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.change_password.init_app(app)
+        self.change_password.live_url = '/flask_change_password/live'
+        with app.test_request_context('/change_password'):
+            form = ChangePasswordForm(username='test.user', changing=True, title='Change Password')
+            html = self.change_password.change_password_template(form)
+        assert 'data-live-url="/flask_change_password/live"' in html, html
+
+
+class NormalizeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.change_password = ChangePassword(min_password_length=10, rules={'pwned': 'off',
+                                                                             'long_password_override': 0})
+
+    def test_normalize(self):
+        assert normalize('P@$$w0rd!') == ('p@$$w0rd!', 'passwordi')
+        # full width compatibility forms and case folding
+        assert normalize('\uff30\uff41\uff53\uff53\uff11') == ('pass1', 'passi')
+        assert normalize('STRA\u00dfE') == ('strasse', 'strasse')
+
+    def test_substitutions_found(self):
+        result = self.change_password.valid_password('P@ssw0rd!Zx9')
+        assert result == 'too similar to common password: password', result
+        result = self.change_password.valid_password('\uff30\uff41\uff53\uff53\uff57\uff4f\uff52\uff44!Zx9')
+        assert result == 'too similar to common password: password', result
+
+    def test_username(self):
+        result = self.change_password.valid_password('Zx9!m@x.smith', username='Max.Smith')
+        assert result == 'insufficient difference from username', result
+
+    def test_sequences(self):
+        result = self.change_password.valid_password('Zu!7ly\uff17\uff18\uff19x')
+        assert result == 'not enough number complexity, 789 disallowed', result
+        result = self.change_password.valid_password('Zu!7ly@bcdx')
+        assert result == 'insufficient letter complexity, @bcd disallowed', result
+        # the run is reported as typed, not with the substitutions undone
+        result = self.change_password.valid_password('Xr5tu!9Kqz')
+        assert result == 'insufficient letter complexity, r5tu disallowed', result
+
+    def test_off(self):
+        self.change_password.update_rules({'normalize': False})
+        result = self.change_password.valid_password('P@ssw0rd!Zx9')
+        assert result == 5, result
+        result = self.change_password.valid_password('Zu!7ly@bcdx')
+        assert result == 5, result
+
+
+class StrengthEstimatorTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        matcher = CommonPasswordMatcher.from_file(COMMON_PASSWORDS_FILE)
+        cls.estimator = StrengthEstimator(lambda: matcher)
+
+    def patterns(self, password, user_inputs=()):
+        return [(match.pattern, match.token) for match in self.estimator.estimate(password, user_inputs).sequence]
+
+    def test_patterns(self):
+        assert self.patterns('password') == [('dictionary', 'password')]
+        assert self.patterns('P@ssw0rd') == [('dictionary', 'P@ssw0rd')]
+        assert self.patterns('zxcvbnm,./') == [('spatial', 'zxcvbnm,./')]
+        assert self.patterns('abcdefg') == [('sequence', 'abcdefg')]
+        assert self.patterns('abcabcabc') == [('repeat', 'abcabcabc')]
+        assert self.patterns('19/05/1990') == [('date', '19/05/1990')]
+        assert self.patterns('Gq7#vKp2!x') == [('bruteforce', 'Gq7#vKp2!x')]
+        assert self.patterns('zz.max.smith', ['Max.Smith']) == [('bruteforce', 'zz.'), ('dictionary', 'max.smith')]
+
+    def test_guesses(self):
+        estimate = self.estimator.estimate('correcthorsebatterystaple')
+        assert estimate.guesses > 1e15 and estimate.score == 4, estimate
+        assert self.estimator.estimate('password').guesses < self.estimator.estimate('Password').guesses
+        assert self.estimator.estimate('Password').guesses < self.estimator.estimate('P@ssw0rd').guesses
+        assert self.estimator.estimate('').guesses == 1
+        assert self.estimator.estimate('Gq7#vKp2!x').guesses == 1e10
+
+    def test_dates(self):
+        assert date_year((19, 5, 1990)) == 1990
+        assert date_year((1, 1, 90)) == 1990
+        assert date_year((32, 32, 1990)) is None
+        assert date_year((1, 13, 13)) == 2013
+
+    def test_long_passwords(self):
+        # estimated on the first MAX_LENGTH characters
+        estimate = self.estimator.estimate('a1' * 100)
+        assert estimate.sequence[-1].j == MAX_LENGTH - 1, estimate.sequence
+        assert estimate.guesses == self.estimator.estimate('a1' * (MAX_LENGTH // 2)).guesses
+        assert self.patterns('7' * MAX_LENGTH) == [('repeat', '7' * MAX_LENGTH)]
+
+    def test_scores(self):
+        assert [guesses_to_score(guesses) for guesses in [1, 1e3, 1e6, 1e8, 1e10, 1e20]] == [0, 0, 1, 2, 3, 4]
+
+    def test_min_guesses_rule(self):
+        change_password = ChangePassword(min_password_length=8, rules={
+            'pwned': 'off', 'long_password_override': 0, 'passwords': False, 'min_guesses': 1e8})
+        result = change_password.valid_password('Football1!')
+        assert result == 'too easy to guess, about 2e+04 guesses', result
+        result = change_password.valid_password('Gq7#vKp2!x')
+        assert result == 4, result
+        result = change_password.valid_password('Xy7!Kq2#Lm9$Pw4')
+        assert result == 5, result
+        assert 'Cannot be easy to guess.' in change_password.get_rules_text()
+        # without the rule every password that passes scores 5
+        change_password.update_rules({'min_guesses': 0})
+        result = change_password.valid_password('Football1!')
+        assert result == 5, result
+        assert change_password.estimate_strength('Football1!').score == 1
+
+
+class SequenceScannerTestCase(unittest.TestCase):
+    def test_runs(self):
+        scanner = SequenceScanner(['alphabet'], 4)
+        assert scanner.find('xxabcxbcdef') == 'bcde'
+        assert scanner.find('abcxyz') is None
+        assert scanner.find('dcba') is None
+        assert SequenceScanner(['alphabet'], 4, descending=True).find('zdcba') == 'dcba'
+        assert SequenceScanner(['alphabet'], 3).find('abcxyz') == 'abc'
+
+    def test_keyboard_layouts(self):
+        scanner = SequenceScanner(['qwerty'], 4)
+        # not across row boundaries
+        assert scanner.find('iopasd') is None
+        assert scanner.find('xcvbnm') == 'xcvb'
+        assert SequenceScanner(['qwertz'], 4).find('rtzu') == 'rtzu'
+        assert SequenceScanner(['azerty'], 4).find('qsdf') == 'qsdf'
+        assert SequenceScanner(['qwerty'], 4).find('qsdf') is None
+        assert SequenceScanner(['numpad'], 3).find('x741') == '741'
+
+    def test_custom_layout(self):
+        register_layout('dvorak', ["',.pyfgcrl", 'aoeuidhtns', ';qjkxbmwvz'])
+        assert SequenceScanner(['dvorak'], 4).find('xaoeu') == 'aoeu'
+        assert SequenceScanner([['135', '79']], 3).find('x135') == '135'
+
+    def test_rules(self):
+        change_password = ChangePassword(min_password_length=8, rules={
+            'long_password_override': 0, 'pwned': 'off', 'keyboard_layouts': ['azerty'],
+            'number_sequence_length': 4, 'descending_sequences': True})
+        result = change_password.valid_password('Zu!7ly123x')
+        assert result == 5, result
+        result = change_password.valid_password('Zu!7ly4321x')
+        assert result == 'not enough number complexity, 4321 disallowed', result
+        result = change_password.valid_password('Zu!7lyazerx')
+        assert result == 'keyboard sequence found, azer disallowed', result
+
+
+class CommonPasswordMatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.matcher = CommonPasswordMatcher(['monkey', 'rudeboy', 'key', '', 'boy'])
+
+    def test_starts_with(self):
+        assert self.matcher.find('monkey9054343hyAy2!') == 'monkey'
+        assert self.matcher.find('key9054343hyAy2!') == 'key'
+
+    def test_contains(self):
+        # first matching entry in list order wins
+        assert self.matcher.find('jjrudeboyAy2!') == 'rudeboy'
+        assert self.matcher.find('xboy') == 'boy'
+        # contained but known password not more than half the length
+        assert self.matcher.find('jj--iuerudeboyAy2!') is None
+
+    def test_blank_lines_ignored(self):
+        assert len(self.matcher) == 4
+        assert self.matcher.find('Zz9!Zz9!') is None
+
+
+# touches every page of a mapped password list then, once told to, reports its /proc/self/smaps Rss and Pss
+SMAPS_CHILD = '''
+import sys
+from flask_change_password.common_passwords import MappedPasswordMatcher
+matcher = MappedPasswordMatcher(sys.argv[1])
+assert matcher.find('password123') == 'password'
+sum(matcher._view[x] for x in range(0, len(matcher._view), 4096))
+print('ready', flush=True)
+sys.stdin.readline()
+figures, mapping = {}, False
+for line in open('/proc/self/smaps'):
+    if line[0] in '0123456789abcdef' and '-' in line.split()[0]:
+        mapping = line.rstrip().endswith(sys.argv[1])
+    elif mapping and line.split()[0] in ('Rss:', 'Pss:'):
+        figures[line.split()[0]] = figures.get(line.split()[0], 0) + int(line.split()[1])
+print(figures.get('Rss:', 0), figures.get('Pss:', 0), flush=True)
+sys.stdin.read()
+'''
+
+
+class MappedPasswordMatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'passwords.words')
+        self.matcher = CommonPasswordMatcher.from_file(COMMON_PASSWORDS_FILE)
+        self.matcher.save(self.filename)
+
+    def tearDown(self):
+        os.remove(self.filename)
+        os.rmdir(self.directory)
+
+    def test_same_results(self):
+        mapped = MappedPasswordMatcher(self.filename)
+        assert len(mapped) == len(self.matcher)
+        candidates = ['Gq7#vKp2!x', 'jj--iuerudeboyAy2!', '\u00c4\u00d6\u00fc', '']
+        candidates += [known + 'X9!' for known in self.matcher.known_passwords[:500]]
+        candidates += ['zz' + known for known in self.matcher.known_passwords[-500:]]
+        for candidate in candidates:
+            assert mapped.find(candidate) == self.matcher.find(candidate), candidate
+        mapped.close()
+
+    def test_not_a_password_list(self):
+        with open(self.filename, 'wb') as f:
+            f.write(b'not a password list')
+        with self.assertRaises(ValueError):
+            MappedPasswordMatcher(self.filename)
+
+    def test_passwords_index_rule(self):
+        change_password = ChangePassword(min_password_length=8, rules={'pwned': 'off', 'long_password_override': 0,
+                                                                       'passwords_index': self.filename})
+        result = change_password.valid_password('Password4!ZZZ')
+        assert result == 'too similar to common password: Password', result
+        assert isinstance(change_password.common_passwords, MappedPasswordMatcher)
+        change_password.update_rules({'passwords_index': ''})
+        assert change_password.common_passwords is None
+
+    @unittest.skipUnless(os.path.exists('/proc/self/smaps'), 'needs /proc/self/smaps')
+    def test_processes_share_pages(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        children = [subprocess.Popen([sys.executable, '-c', SMAPS_CHILD, self.filename], cwd=root,
+                                     stdin=subprocess.PIPE, stdout=subprocess.PIPE) for _ in range(3)]
+        try:
+            for child in children:
+                assert child.stdout.readline().strip() == b'ready'
+            # every child has the file mapped, and keeps it mapped, until all of them have reported
+            for child in children:
+                child.stdin.write(b'report\n')
+                child.stdin.flush()
+            figures = [[int(x) for x in child.stdout.readline().split()] for child in children]
+        finally:
+            for child in children:
+                child.stdin.close()
+                child.wait(60)
+        for rss, pss in figures:
+            assert rss > 0, figures
+            # the proportional share is less than the resident size only when the pages are shared
+            assert pss < rss, figures
+
+
+class DictionaryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filenames = []
+
+    def tearDown(self):
+        for filename in self.filenames:
+            os.remove(filename)
+        os.rmdir(self.directory)
+
+    def build(self, name, words, **kwargs):
+        source = os.path.join(self.directory, name + '.txt')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(words) + '\n')
+        filename = os.path.join(self.directory, name + '.dict')
+        written = build_dictionary(source, filename, **kwargs)
+        os.remove(source)
+        self.filenames.append(filename)
+        return filename, written
+
+    def test_build(self):
+        words = ['rudeboy', 'monkey', 'ab', 'monkey', 'm\u00f6nkey', 'rude', 'zebra'] + [
+            'word{:04d}'.format(x) for x in range(100)]
+        filename, written = self.build('words', words, chunk_size=7, block_size=4)
+        assert written == 105, written
+        index = DictionaryIndex(filename)
+        assert len(index) == 105
+        for word in words:
+            assert (word in index) == (word != 'ab'), word
+        assert 'monke' not in index and 'zzz' not in index and '' not in index
+        index.close()
+
+    def test_find(self):
+        filename, written = self.build('words', ['monkey', 'rudeboy', 'key', 'boy', 'rude', 'm\u00f6nkey'],
+                                       block_size=2)
+        index = DictionaryIndex(filename)
+        assert index.find('monkey9054343hyAy2!') == 'monkey'
+        assert index.find('key9054343hyAy2!') == 'key'
+        # the longest match is reported
+        assert index.find('jjrudeboyAy2!') == 'rudeboy'
+        assert index.find('xboy') == 'boy'
+        assert index.find('jj--iuerudeboyAy2!') is None
+        assert index.find('m\u00f6nkey!') == 'm\u00f6nkey'
+        assert index.find('Zz9!Zz9!') is None
+        assert index.find('') is None
+        index.close()
+        # a word found at a later start only replaces a longer one found earlier
+        filename, written = self.build('overlap', ['caddb', 'addb'])
+        index = DictionaryIndex(filename)
+        assert index.find('caddby\u00e9') == 'caddb'
+        index.close()
+
+    def test_same_matches_as_common_passwords(self):
+        matcher = CommonPasswordMatcher.from_file(COMMON_PASSWORDS_FILE)
+        filename, written = self.build('common', matcher.known_passwords)
+        index = DictionaryIndex(filename)
+        for known in matcher.known_passwords[::7]:
+            for candidate in [known + 'X9!', 'zz' + known, 'Q' + known[1:] + 'Q']:
+                assert (index.find(candidate) is None) == (matcher.find(candidate) is None), candidate
+        index.close()
+
+    def test_empty(self):
+        filename, written = self.build('empty', ['', 'ab'])
+        assert written == 0
+        index = DictionaryIndex(filename)
+        assert index.find('anything') is None and 'anything' not in index
+        index.close()
+
+    def test_not_a_dictionary(self):
+        filename = os.path.join(self.directory, 'bad.dict')
+        self.filenames.append(filename)
+        with open(filename, 'wb') as f:
+            f.write(b'not a dictionary index at all, but long enough')
+        with self.assertRaises(ValueError):
+            DictionaryIndex(filename)
+
+    def test_dictionaries_rule(self):
+        breached, written = self.build('breached', ['qgzmxwv', 'hunter'])
+        banned, written = self.build('banned', ['acmecorp'])
+        change_password = ChangePassword(min_password_length=8, rules={
+            'pwned': 'off', 'long_password_override': 0, 'dictionaries': [breached, banned]})
+        result = change_password.valid_password('Xw7!Plq4Zt')
+        assert result == 5, result
+        result = change_password.valid_password('qgzmxwv4!Z')
+        assert result == 'too similar to banned password: qgzmxwv', result
+        result = change_password.valid_password('Z4!acmecorp')
+        assert result == 'too similar to banned password: acmecorp', result
+        assert 'Cannot be like a banned password.' in change_password.get_rules_text()
+        change_password.update_rules({'dictionaries': []})
+        result = change_password.valid_password('Z4!acmecorp')
+        assert result == 5, result
+
+    def test_dictionaries_shared(self):
+        breached, written = self.build('breached', ['qgzmxwv'])
+        banned, written = self.build('banned', ['acmecorp'])
+        dictionaries = [breached]
+        change_password = ChangePassword(min_password_length=8, rules={'pwned': 'off', 'long_password_override': 0})
+        change_password.update_rules(dict(dictionaries=dictionaries))
+        # the profile keeps the list it was given, not the caller's list
+        dictionaries.append(banned)
+        assert change_password.rules['dictionaries'] == (breached,)
+        result = change_password.valid_password('Z4!acmecorp')
+        assert result == 5, result
+        # another profile changing leaves the loaded dictionary alone
+        index = change_password.get_dictionaries()[0]
+        change_password.update_rules(dict(uppercase=3), profile='tenant')
+        change_password.update_rules(dict(uppercase=2), profile='tenant')
+        assert change_password.get_dictionaries()[0] is index
+        # and it is closed once no profile names it, tenant started from a copy of the default rules
+        change_password.update_rules(dict(dictionaries=[]))
+        assert not index._map.closed
+        change_password.remove_profile('tenant')
+        assert index._map.closed
+
+    def test_command(self):
+        source = os.path.join(self.directory, 'words.txt')
+        target = os.path.join(self.directory, 'words.dict')
+        self.filenames.extend([source, target])
+        with open(source, 'w') as f:
+            f.write('hunter\nab\nacmecorp\n')
+        app = Flask(__name__)
+        ChangePassword(app=app)
+        result = app.test_cli_runner().invoke(args=['change-password', 'build-dictionary', source, target])
+        assert '2 words written' in result.output, result.output
+        index = DictionaryIndex(target)
+        assert 'acmecorp' in index
+        index.close()
+
+
+class LocalPwnedTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_filename = os.path.join(self.directory, 'pwned.idx')
+        dump_filename = os.path.join(self.directory, 'pwned.txt')
+        with open(dump_filename, 'w') as f:
+            for password, count in [('monkey', 100), ('password', 5000), ('rarely', 2), ('monkey', 100)]:
+                f.write('{}:{}\n'.format(hashlib.sha1(password.encode()).hexdigest().upper(), count))
+        self.written = build_pwned_index(dump_filename, self.index_filename, chunk_size=2)
+        os.remove(dump_filename)
+
+    def tearDown(self):
+        os.remove(self.index_filename)
+        os.rmdir(self.directory)
+
+    def test_build(self):
+        assert self.written == 3, self.written
+
+    def test_index(self):
+        index = LocalPwnedIndex(self.index_filename)
+        assert index.count(sha1_digest('password')) == 5000
+        assert index.is_pwned('monkey')
+        assert not index.is_pwned('not pwned at all')
+        index.close()
+        index = LocalPwnedIndex(self.index_filename, min_count=10)
+        assert not index.is_pwned('rarely')
+        index.close()
+
+    def test_local_rule(self):
+        change_password = ChangePassword(min_password_length=0, rules={
+            'punctuation': 0, 'uppercase': 0, 'lowercase': 0, 'numbers': 0, 'passwords': False,
+            'long_password_override': 0, 'pwned': 'local', 'pwned_index': self.index_filename})
+        result = change_password.valid_password('monkey')
+        assert 'is a known hacked password' in result, result
+        result = change_password.valid_password('Zz9!Zz9!')
+        assert result == 5, result
+        change_password.update_rules({'pwned': 'off'})
+        result = change_password.valid_password('monkey')
+        assert result == 5, result
+
+    def test_missing_index(self):
+        missing = os.path.join(self.directory, 'missing.idx')
+        with self.assertRaises(ValueError):
+            ChangePassword(min_password_length=0, rules={'pwned': 'local'})
+        change_password = ChangePassword(min_password_length=0, rules={
+            'punctuation': 0, 'uppercase': 0, 'lowercase': 0, 'numbers': 0, 'passwords': False,
+            'long_password_override': 0, 'pwned': 'local', 'pwned_index': missing})
+        with self.assertLogs('flask_change_password.flask_change_password', 'ERROR'):
+            result = change_password.validate('Zz9!Zz9!')
+        # the file name and errno stay on the server
+        assert result.messages == ['pwned check failed, try again'], result.messages
+        with self.assertLogs('flask_change_password.flask_change_password', 'ERROR'):
+            results = list(change_password.validate_many([('Zz9!Zz9!', '')], processes=0))
+        assert results[0][2] == 'pwned check failed, try again', results
+        app = Flask(__name__)
+        with self.assertRaises(ValueError) as context:
+            change_password.init_app(app, warmup=True)
+        assert missing in str(context.exception), context.exception
+
+
+class PwnedRangeHandler(BaseHTTPRequestHandler):
+    """
+    stub of the HIBP range API that knows about a few passwords
+    """
+    passwords = {'monkey': 1000, 'password': 3}
+    requests = 0
+
+    def do_GET(self):
+        PwnedRangeHandler.requests += 1
+        prefix = self.path.rsplit('/', 1)[-1]
+        lines = []
+        for password, count in self.passwords.items():
+            full_hash = hashlib.sha1(password.encode()).hexdigest().upper()
+            if full_hash.startswith(prefix):
+                lines.append('{}:{}'.format(full_hash[5:], count))
+        lines.append('{}:1'.format('0' * 35))
+        body = '\r\n'.join(lines).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_pwned_server():
+    server = HTTPServer(('127.0.0.1', 0), PwnedRangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+
+class PwnedClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server, url = start_pwned_server()
+        PwnedRangeHandler.requests = 0
+        self.client = PwnedClient(url=url, cache_size=2, ttl=60)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_count(self):
+        assert self.client.count('monkey') == 1000
+        assert self.client.count('monkey') == 1000
+        assert self.client.count('not pwned at all') == 0
+        assert PwnedRangeHandler.requests == 2, PwnedRangeHandler.requests
+        assert self.client.stats()['hits'] == 1, self.client.stats()
+        assert self.client.stats()['misses'] == 2, self.client.stats()
+
+    def test_compact_range(self):
+        suffixes = PwnedClient.parse_range('{}:3\r\n{}:12\r\n'.format('F' * 35, '0' * 34 + '1'))
+        assert len(suffixes) == 2
+        assert suffixes.get('F' * 35) == 3 and suffixes.get('0' * 34 + '1') == 12
+        assert suffixes.get('A' * 35) == 0 and suffixes.get('not hex') == 0
+
+    def test_lru_eviction(self):
+        for password in ['monkey', 'password', 'another one']:
+            self.client.count(password)
+        assert self.client.stats()['size'] == 2
+        self.client.count('monkey')
+        assert PwnedRangeHandler.requests == 4, PwnedRangeHandler.requests
+
+    def test_ttl(self):
+        self.client.ttl = 0
+        self.client.count('monkey')
+        time.sleep(0.01)
+        self.client.count('monkey')
+        assert PwnedRangeHandler.requests == 2, PwnedRangeHandler.requests
+
+    def test_validate_many(self):
+        change_password = ChangePassword(min_password_length=8, pwned_client=self.client, rules={
+            'punctuation': 0, 'uppercase': 0, 'numbers': 0, 'passwords': False, 'long_password_override': 0})
+        passwords = [('monkey!!', ''), ('tiny', ''), ('monkey!!', ''), ('password', ''), ('Numbers2!', 'numbers'),
+                     ('not pwned at all', '')]
+        for processes in [0, 2]:
+            PwnedRangeHandler.requests = 0
+            self.client.clear()
+            results = list(change_password.validate_many(passwords, processes=processes, batch_size=4))
+            assert [result[:2] for result in results] == passwords, results
+            assert [result[2] for result in results] == [
+                5, 'insufficient length.  Required 8', 5, 'is a known hacked password',
+                'insufficient difference from username', 5], results
+            # monkey!! is fetched once per batch
+            assert PwnedRangeHandler.requests == 3, PwnedRangeHandler.requests
+
+    def test_result_cache(self):
+        result_cache = ResultCache(size=2, ttl=60)
+        change_password = ChangePassword(min_password_length=8, pwned_client=self.client, result_cache=result_cache)
+        for _ in range(3):
+            assert change_password.valid_password('ru%d*ebo#Ay1!', 'Numbers') == 5
+            assert change_password.valid_password('monkey!!', '') == '1 uppercase required'
+        assert PwnedRangeHandler.requests == 1, PwnedRangeHandler.requests
+        assert result_cache.stats()['hits'] == 4, result_cache.stats()
+        # a rules change is a different key
+        change_password.update_rules(dict(uppercase=0))
+        assert change_password.valid_password('monkey!!', '') == '1 number required'
+        assert result_cache.stats()['evictions'] == 1, result_cache.stats()
+        key = result_cache.key('monkey!!', '', change_password.rules_version)
+        assert b'monkey' not in key
+
+    def test_collect_all_cached(self):
+        result_cache = ResultCache(size=8, ttl=60)
+        change_password = ChangePassword(min_password_length=8, pwned_client=self.client, result_cache=result_cache)
+        for _ in range(3):
+            result = change_password.validate('tiny', collect_all=True)
+            assert result.rules[0] == 'min_password_length', result
+            assert change_password.validate('ru%d*ebo#Ay1!', 'Numbers', collect_all=True).score == 5
+        # rule failures are never looked up
+        assert PwnedRangeHandler.requests == 1, PwnedRangeHandler.requests
+        assert result_cache.stats()['hits'] == 4, result_cache.stats()
+        # the first failure result is cached separately
+        assert change_password.validate('tiny').rules == ['min_password_length']
+        assert result_cache.stats()['misses'] == 3, result_cache.stats()
+
+    def test_metrics(self):
+        events = []
+        metrics = Metrics(callbacks=[lambda kind, name, value: events.append((kind, name))])
+        change_password = ChangePassword(min_password_length=8, pwned_client=self.client, metrics=metrics)
+        app = Flask(__name__)
+        app.testing = True
+        change_password.init_app(app, metrics_route=True)
+        client = app.test_client()
+        for password in ['tiny', 'monkey!!', 'ru%d*ebo#Ay1!', 'Numbers2!', 'ru%d*eboyAy123!']:
+            client.post('/flask_change_password/check_password', json=dict(password=password, username='numbers'))
+        assert metrics.requests == {'check_password': 5}, metrics.requests
+        assert metrics.rejections == {'min_password_length': 1, 'uppercase': 1, 'username': 1,
+                                      'number_sequence': 1}, metrics.rejections
+        assert metrics.latencies['pwned'].count == 1
+        assert metrics.latencies['characters'].count == 4
+        assert ('rejection', 'uppercase') in events, events
+        text = client.get('/flask_change_password/metrics').data.decode('utf-8')
+        assert 'flask_change_password_rejections_total{rule="uppercase"} 1' in text, text
+        assert 'flask_change_password_rule_seconds_count{rule="pwned"} 1' in text, text
+        assert 'flask_change_password_rule_seconds_bucket{rule="pwned",le="+Inf"} 1' in text, text
+        assert 'flask_change_password_pwned_fetches 1' in text, text
+
+    def test_max_concurrent(self):
+        client = PwnedClient(url=self.client.url, max_concurrent=1, queue_timeout=0)
+        client._acquire()
+        with self.assertRaises(Exception) as context:
+            client.count('monkey')
+        assert 'too many pwned checks' in str(context.exception)
+        client._release()
+        assert client.count('monkey') == 1000
+        assert client.stats()['rejected'] == 1
+
+    def test_min_count_rule(self):
+        change_password = ChangePassword(min_password_length=0, pwned_client=self.client, rules={
+            'punctuation': 0, 'uppercase': 0, 'lowercase': 0, 'numbers': 0, 'passwords': False,
+            'long_password_override': 0, 'pwned_min_count': 10})
+        result = change_password.valid_password('monkey')
+        assert 'is a known hacked password' in result, result
+        result = change_password.valid_password('password')
+        assert result == 5, result
+
+
+class UnreliableRangeHandler(PwnedRangeHandler):
+    """
+    stub of the HIBP range API that can be slow or fail
+    """
+    delay = 0
+    status = 200
+
+    def do_GET(self):
+        time.sleep(UnreliableRangeHandler.delay)
+        if UnreliableRangeHandler.status == 200:
+            return super().do_GET()
+        PwnedRangeHandler.requests += 1
+        self.send_response(UnreliableRangeHandler.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class PwnedResilienceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), UnreliableRangeHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+        PwnedRangeHandler.requests = 0
+        UnreliableRangeHandler.delay = 0
+        UnreliableRangeHandler.status = 200
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_single_flight(self):
+        UnreliableRangeHandler.delay = 0.2
+        client = PwnedClient(url=self.url)
+        counts = []
+        threads = [threading.Thread(target=lambda: counts.append(client.count('monkey'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert counts == [1000] * 8, counts
+        assert PwnedRangeHandler.requests == 1, PwnedRangeHandler.requests
+        assert client.stats()['coalesced'] == 7, client.stats()
+
+    def test_single_flight_async(self):
+        UnreliableRangeHandler.delay = 0.2
+        client = PwnedClient(url=self.url)
+
+        async def count_all():
+            try:
+                return await asyncio.gather(*[client.count_async('monkey') for _ in range(5)])
+            finally:
+                await client.aclose()
+
+        assert asyncio.run(count_all()) == [1000] * 5
+        assert PwnedRangeHandler.requests == 1, PwnedRangeHandler.requests
+        # the pooled session is shared by every event loop
+        assert client._async_session is None
+        assert client._session is not None
+
+    def test_single_flight_loop_per_thread(self):
+        # as Flask async views, each on its own event loop
+        UnreliableRangeHandler.delay = 0.2
+        client = PwnedClient(url=self.url)
+        counts = []
+        threads = [threading.Thread(target=lambda: counts.append(asyncio.run(client.count_async('monkey'))))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert counts == [1000] * 5, counts
+        assert PwnedRangeHandler.requests == 1, PwnedRangeHandler.requests
+
+    def test_async_http(self):
+        try:
+            import httpx  # noqa: F401
+        except ImportError:
+            self.skipTest('httpx required')
+        client = PwnedClient(url=self.url, async_http=True)
+
+        async def count():
+            try:
+                count = await client.count_async('monkey')
+                assert client._async_session is not None
+                return count
+            finally:
+                await client.aclose()
+
+        assert asyncio.run(count()) == 1000
+        assert client._async_session is None
+        assert client._session is None
+
+    def test_single_flight_error(self):
+        UnreliableRangeHandler.delay = 0.2
+        UnreliableRangeHandler.status = 503
+        client = PwnedClient(url=self.url)
+        errors = []
+
+        def count():
+            try:
+                client.count('monkey')
+            except PwnedUnavailable as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=count) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(errors) == 4, errors
+        assert PwnedRangeHandler.requests == 1, PwnedRangeHandler.requests
+
+    def test_circuit_breaker(self):
+        UnreliableRangeHandler.status = 503
+        breaker = CircuitBreaker(min_calls=2, reset_timeout=0.1)
+        client = PwnedClient(url=self.url, breaker=breaker)
+        for password in ['monkey', 'password']:
+            with self.assertRaises(PwnedUnavailable):
+                client.count(password)
+        assert breaker.state == 'open'
+        with self.assertRaises(PwnedUnavailable) as context:
+            client.count('another one')
+        assert 'suspended' in str(context.exception)
+        assert PwnedRangeHandler.requests == 2, PwnedRangeHandler.requests
+        # half open, a failed probe opens it again
+        time.sleep(0.15)
+        with self.assertRaises(PwnedUnavailable):
+            client.count('another one')
+        assert breaker.state == 'open' and breaker.opens == 2
+        UnreliableRangeHandler.status = 200
+        time.sleep(0.15)
+        assert client.count('monkey') == 1000
+        assert breaker.state == 'closed'
+        assert client.stats()['circuit_refused'] == 1, client.stats()
+
+    def test_half_open_single_probe(self):
+        breaker = CircuitBreaker(min_calls=1, reset_timeout=0.05)
+        breaker.record(False)
+        assert not breaker.allow()
+        time.sleep(0.06)
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record(True)
+        assert breaker.allow() and breaker.state == 'closed'
+
+    def test_error_rate(self):
+        breaker = CircuitBreaker(error_rate=0.5, min_calls=4)
+        for ok in [True, True, True, False, False]:
+            breaker.record(ok)
+        assert breaker.state == 'closed'
+        breaker.record(False)
+        assert breaker.state == 'open'
+
+    def test_latency_budget(self):
+        UnreliableRangeHandler.delay = 0.5
+        breaker = CircuitBreaker(min_calls=1, latency_budget=0.1)
+        client = PwnedClient(url=self.url, breaker=breaker)
+        start = time.monotonic()
+        with self.assertRaises(PwnedUnavailable):
+            client.count('monkey')
+        assert time.monotonic() - start < 0.4
+        assert breaker.state == 'open'
+        # slow answers within the timeout count as failures too
+        breaker = CircuitBreaker(min_calls=1, latency_budget=0.01)
+        breaker.record(True, 0.02)
+        assert breaker.state == 'open'
+
+    def test_failure_policy(self):
+        UnreliableRangeHandler.status = 503
+        client = PwnedClient(url=self.url)
+        change_password = ChangePassword(min_password_length=8, pwned_client=client)
+        result = change_password.valid_password('ru%d*ebo#Ay1!', 'Numbers')
+        assert 'pwned check failed' in result, result
+        # a batch applies the same policy
+        results = list(change_password.validate_many([('ru%d*ebo#Ay1!', 'Numbers')], processes=0))
+        assert results[0][2] == result, results
+        change_password.update_rules(dict(pwned_failure='open'))
+        assert change_password.valid_password('ru%d*ebo#Ay1!', 'Numbers') == 5
+        results = list(change_password.validate_many([('ru%d*ebo#Ay1!', 'Numbers')], processes=0))
+        assert results[0][2] == 5, results
+        with self.assertRaises(ValueError):
+            change_password.update_rules(dict(pwned_failure='maybe'))
+
+    def test_fail_open_not_cached(self):
+        UnreliableRangeHandler.status = 503
+        change_password = ChangePassword(min_password_length=0, pwned_client=PwnedClient(url=self.url),
+                                         result_cache=ResultCache(size=10, ttl=60), rules={
+                                             'punctuation': 0, 'uppercase': 0, 'lowercase': 0, 'numbers': 0,
+                                             'passwords': False, 'long_password_override': 0,
+                                             'pwned_failure': 'open'})
+        assert change_password.valid_password('monkey') == 5
+        # accepted during the outage only, once the service is back the password is checked again
+        UnreliableRangeHandler.status = 200
+        assert change_password.valid_password('monkey') == 'is a known hacked password'
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server, url = start_pwned_server()
+        PwnedRangeHandler.requests = 0
+        self.directory = tempfile.mkdtemp()
+        self.dump_filename = os.path.join(self.directory, 'pwned.txt')
+        self.filter_filename = os.path.join(self.directory, 'pwned.bloom')
+        with open(self.dump_filename, 'w') as f:
+            for password, count in PwnedRangeHandler.passwords.items():
+                f.write('{}:{}\n'.format(hashlib.sha1(password.encode()).hexdigest().upper(), count))
+        self.change_password = ChangePassword(min_password_length=0, pwned_client=PwnedClient(url=url), rules={
+            'punctuation': 0, 'uppercase': 0, 'lowercase': 0, 'numbers': 0, 'passwords': False,
+            'long_password_override': 0, 'pwned_bloom': self.filter_filename})
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        for filename in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, filename))
+        os.rmdir(self.directory)
+
+    def build(self):
+        app = Flask(__name__)
+        self.change_password.init_app(app)
+        result = app.test_cli_runner().invoke(args=['change-password', 'build-bloom', self.dump_filename,
+                                                    self.filter_filename, '--error-rate', '0.01'])
+        assert result.exit_code == 0, result.output
+        assert '2 hashes' in result.output, result.output
+
+    def test_false_positive_rate(self):
+        bloom_filter = BloomFilter(1000, error_rate=0.01)
+        for _ in range(1000):
+            bloom_filter.add(os.urandom(20))
+        digest = sha1_digest('monkey')
+        bloom_filter.add(digest)
+        assert digest in bloom_filter
+        stats = benchmark_bloom_filter(bloom_filter, samples=10000)
+        assert stats['answered_by_filter'] > 0.97, stats
+        assert stats['bytes'] < 1300, stats
+
+    def test_save_load(self):
+        self.build()
+        bloom_filter = BloomFilter.load(self.filter_filename)
+        assert bloom_filter.count == 2
+        assert bloom_filter.might_be_pwned('monkey')
+        assert bloom_filter.might_be_pwned('password')
+
+    def test_check_pwned(self):
+        self.build()
+        result = self.change_password.valid_password('monkey')
+        assert 'is a known hacked password' in result, result
+        assert PwnedRangeHandler.requests == 1, PwnedRangeHandler.requests
+        for password in ['not pwned', 'also not pwned', 'still not pwned']:
+            self.change_password.valid_password(password)
+        assert PwnedRangeHandler.requests < 3, PwnedRangeHandler.requests
+        assert self.change_password.get_pwned_bloom().negatives > 0
+
+
+class AsyncTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server, url = start_pwned_server()
+        PwnedRangeHandler.requests = 0
+        self.change_password = ChangePassword(min_password_length=8, pwned_client=PwnedClient(url=url))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_password_good_enough_async(self):
+        score = asyncio.run(self.change_password.password_good_enough_async('ru%d*ebo#Ay1!', username='Numbers'))
+        assert score == 5, score
+        with self.assertRaises(Exception) as context:
+            asyncio.run(self.change_password.password_good_enough_async('ru%d*eboyAy123!'))
+        assert 'not enough number complexity, 123 disallowed' in str(context.exception)
+
+    def test_check_pwned_async(self):
+        with self.assertRaises(Exception) as context:
+            asyncio.run(self.change_password.check_pwned_async('monkey'))
+        assert 'is a known hacked password' in str(context.exception)
+        asyncio.run(self.change_password.check_pwned_async('not pwned at all'))
+        assert PwnedRangeHandler.requests == 2, PwnedRangeHandler.requests
+
+    def test_route_check_password_async(self):
+        try:
+            import asgiref  # noqa: F401
+        except ImportError:
+            self.skipTest('asgiref required for async Flask views')
+        app = Flask(__name__)
+        app.testing = True
+        self.change_password.init_app(app, use_async=True)
+        result = app.test_client().post('/flask_change_password/check_password', json=dict(password='tiny'))
+        assert 'insufficient length' in result.data.decode('utf-8'), result.data
+
+
 class ClientAppTestCase(unittest.TestCase):
     def setUp(self):
         app = Flask(__name__, static_url_path='/static')
@@ -154,18 +1317,143 @@ class ClientAppTestCase(unittest.TestCase):
         self.change_password = ChangePassword(app=app, min_password_length=8)
         self.app = app.test_client()
 
+    def test_check_passwords(self):
+        result = self.app.post('/flask_change_password/check_passwords', json=dict(passwords=[]))
+        assert result.status_code == 404, result.status_code
+        app = Flask(__name__)
+        app.testing = True
+        self.change_password.init_app(app, bulk_limit=2)
+        self.change_password.update_rules(dict(pwned='off'))
+        client = app.test_client()
+        result = client.post('/flask_change_password/check_passwords', json=dict(passwords=[
+            dict(password='tiny'), dict(password='ru%d*ebo#Ay1!', username='Numbers')]))
+        assert result.json == ['insufficient length.  Required 8', 5], result.json
+        result = client.post('/flask_change_password/check_passwords', json=dict(passwords=[{}, {}, {}]))
+        assert result.status_code == 413, result.status_code
+
     def test_check_password(self):
         result = self.app.post('/flask_change_password/check_password', data=dict(password='tiny'),
                                follow_redirects=True)
         result_text = result.data.decode('utf-8')
         assert 'length' in result_text, result_text
 
+    def test_validate_password(self):
+        self.change_password.update_rules(dict(pwned='off'))
+        result = self.app.post('/flask_change_password/validate_password', json=dict(password='tiny'))
+        assert result.status_code == 200, result.status_code
+        assert not result.json['valid'] and result.json['score'] == 0, result.json
+        rules = [failure['rule'] for failure in result.json['failures']]
+        assert rules[0] == 'min_password_length' and len(rules) > 1, rules
+
     def test_get_password_page(self):
         result = self.app.get('/change_password')
         assert result.status_code == 200
         result_text = result.data.decode('utf-8')
         assert 'Current Password' in result_text, result_text
 
+    def test_template_cached(self):
+        self.app.get('/change_password')
+        assert len(self.change_password.templates) == 1
+        compiled = list(self.change_password.templates.values())[0]
+        self.app.get('/change_password')
+        assert list(self.change_password.templates.values())[0] is compiled
+        rules_text = self.change_password.get_rules_text()
+        assert self.change_password.get_rules_text() is rules_text
+        self.change_password.update_rules(dict(min_password_length=12))
+        assert len(self.change_password.templates) == 0
+        assert 'at least 12 characters' in self.change_password.get_rules_text()
+        result = self.app.get('/change_password')
+        assert 'at least 12 characters' in result.data.decode('utf-8')
+
+    def test_static(self):
+        result = self.app.get('/flask_change_password/static/10_million_password_list_top_10000.txt')
+        assert result.status_code == 404, result.status_code
+        result = self.app.get('/change_password')
+        version = self.change_password.get_assets()['pageChangePassword.js'].version
+        script_url = '/flask_change_password/static/pageChangePassword.js?v={}'.format(version)
+        assert script_url in result.data.decode('utf-8'), result.data
+
+        result = self.app.get(script_url)
+        assert result.status_code == 200
+        assert 'immutable' in result.headers['Cache-Control']
+        assert 'FlaskChangePasswordViewModel' in result.data.decode('utf-8')
+        etag = result.headers['ETag']
+        result = self.app.get(script_url, headers={'If-None-Match': etag})
+        assert result.status_code == 304, result.status_code
+
+        result = self.app.get('/flask_change_password/static/pageChangePassword.js',
+                              headers={'Accept-Encoding': 'gzip'})
+        assert result.headers['Content-Encoding'] == 'gzip'
+        assert result.headers['Cache-Control'] == 'no-cache'
+        assert result.headers['ETag'] != etag
+        assert 'Accept-Encoding' in result.headers['Vary']
+        assert b'FlaskChangePasswordViewModel' in gzip.decompress(result.data)
+        # the same bytes from every worker, a gzip timestamp would differ
+        assert result.data == self.app.get('/flask_change_password/static/pageChangePassword.js',
+                                           headers={'Accept-Encoding': 'gzip'}).data
+        assert result.data[4:8] == b'\0\0\0\0'
+
+    def test_get_rules(self):
+        result = self.app.get('/flask_change_password/get_rules')
+        assert result.json['min_password_length'] == 8, result.json
+        assert result.headers['Cache-Control'] == 'no-cache'
+        etag = result.headers['ETag']
+        result = self.app.get('/flask_change_password/get_rules', headers={'If-None-Match': etag})
+        assert result.status_code == 304, result.status_code
+        self.change_password.update_rules(dict(min_password_length=12))
+        result = self.app.get('/flask_change_password/get_rules', headers={'If-None-Match': etag})
+        assert result.status_code == 200, result.status_code
+        assert result.json['min_password_length'] == 12, result.json
+
+    def test_rules_inlined(self):
+        self.change_password.update_rules(dict(show_hide_passwords='</script>'))
+        result = self.app.get('/change_password').data.decode('utf-8')
+        assert '"min_password_length": 8' in result, result
+        assert '\\u003c/script\\u003e' in result, result
+
+    def test_rules_allow_list(self):
+        self.change_password.update_rules(dict(pwned_index='/srv/secret/pwned.idx', dictionaries=['/srv/words']))
+        rules = self.app.get('/flask_change_password/get_rules').json
+        assert 'pwned_index' not in rules and 'dictionaries' not in rules, rules
+        assert rules['check_password_debounce'] == 300, rules
+        assert '/srv/' not in self.app.get('/change_password').data.decode('utf-8')
+
+    def test_rate_limit(self):
+        app = Flask(__name__)
+        app.testing = True
+        change_password = ChangePassword(min_password_length=8)
+        change_password.init_app(app, rate_limiter=RateLimiter(burst=2, rate=0.5))
+        client = app.test_client()
+        for _ in range(2):
+            result = client.post('/flask_change_password/check_password', json=dict(password='tiny'))
+            assert result.status_code == 200, result.status_code
+        result = client.post('/flask_change_password/check_password', json=dict(password='tiny'))
+        assert result.status_code == 429, result.status_code
+        assert result.headers['Retry-After'] == '2'
+        # another client has its own bucket
+        result = client.post('/flask_change_password/check_password', json=dict(password='tiny'),
+                             environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        assert result.status_code == 200, result.status_code
+
+    def test_rate_limit_bulk(self):
+        app = Flask(__name__)
+        app.testing = True
+        change_password = ChangePassword(min_password_length=8)
+        with self.assertRaises(ValueError):
+            change_password.init_app(app, bulk_limit=5, rate_limiter=RateLimiter(burst=4, rate=0.01))
+        app = Flask(__name__)
+        app.testing = True
+        change_password.init_app(app, bulk_limit=4, rate_limiter=RateLimiter(burst=4, rate=0.01))
+        client = app.test_client()
+        passwords = [dict(password='tiny')] * 3
+        result = client.post('/flask_change_password/check_passwords', json=dict(passwords=passwords))
+        assert result.status_code == 200, result.status_code
+        # one token left, not enough for 3 passwords
+        result = client.post('/flask_change_password/check_passwords', json=dict(passwords=passwords))
+        assert result.status_code == 429, result.status_code
+        result = client.post('/flask_change_password/check_password', json=dict(password='tiny'))
+        assert result.status_code == 200, result.status_code
+
     def test_update_password(self):
         new_password = 'Atiny98437fdsjkl---387'
         result = self.app.post('/change_password',
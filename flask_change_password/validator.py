@@ -0,0 +1,277 @@
+import re
+import string
+import time
+import unicodedata
+
+from .sequences import SequenceScanner
+
+UPPERCASE, LOWERCASE, DIGIT, PUNCTUATION = range(4)
+CHARACTER_CLASSES = dict([(c, UPPERCASE) for c in string.ascii_uppercase] +
+                         [(c, LOWERCASE) for c in string.ascii_lowercase] +
+                         [(c, DIGIT) for c in string.digits] +
+                         [(c, PUNCTUATION) for c in string.punctuation])
+USERNAME_RE = re.compile(r'^[A-Za-z0-9]+(?:[ .-][A-Za-z0-9]+)*$')
+# common letter substitutions, applied after case folding
+LEET_TABLE = str.maketrans({'0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '9': 'g',
+                            '@': 'a', '$': 's', '!': 'i', '|': 'l', '+': 't', '(': 'c'})
+
+
+def plural(number):
+    return 's' if number > 1 else ''
+
+
+def normalize(password):
+    """
+    NFKC normalize and case fold the password, so full width and other
+    compatibility forms compare equal, then undo common letter substitutions
+    :return: (folded, folded with substitutions undone)
+    """
+    if not password.isascii():
+        password = unicodedata.normalize('NFKC', password)
+    folded = password.casefold()
+    return folded, folded.translate(LEET_TABLE)
+
+
+def count_character_classes(password):
+    """
+    count the uppercase, lowercase, digit and punctuation characters in one pass
+    :return: list of counts indexed by character class
+    """
+    counts = [0, 0, 0, 0]
+    classes = CHARACTER_CLASSES
+    for c in password:
+        character_class = classes.get(c)
+        if character_class is not None:
+            counts[character_class] += 1
+    return counts
+
+
+class ValidationResult:
+    """
+    Outcome of validating a password or user name: the score and the
+    (rule, message) of each rule that failed
+    """
+    __slots__ = ('score', 'failures')
+
+    def __init__(self, score, failures=None):
+        self.score = score
+        self.failures = failures or []
+
+    @property
+    def valid(self):
+        return not self.failures
+
+    def __bool__(self):
+        return not self.failures
+
+    @property
+    def rules(self):
+        return [rule for rule, message in self.failures]
+
+    @property
+    def messages(self):
+        return [message for rule, message in self.failures]
+
+    def fail(self, rule, message):
+        self.failures.append((rule, message))
+        self.score = 0
+
+    def to_dict(self):
+        return dict(valid=self.valid, score=self.score,
+                    failures=[dict(rule=rule, message=message) for rule, message in self.failures])
+
+    def __repr__(self):
+        return 'ValidationResult(score={!r}, failures={!r})'.format(self.score, self.failures)
+
+
+class PasswordValidator:
+    """
+    Rules compiled into precomputed state by ChangePassword.update_rules.
+    Immutable, so it can be swapped in while other threads validate.
+    """
+    __slots__ = ('min_password_length', 'long_password_length', 'uppercase', 'lowercase', 'numbers', 'punctuation',
+                 'username', 'number_sequences', 'alphabet_sequences', 'keyboard_sequences', 'common_passwords',
+                 'dictionaries', 'normalize', 'strength', 'min_guesses', 'checks')
+
+    def __init__(self, rules, common_passwords=None, dictionaries=None, strength=None):
+        """
+        :param rules: ChangePassword rules
+        :param common_passwords: function returning the CommonPasswordMatcher, called when the passwords rule is on
+        :param dictionaries: function returning the DictionaryIndex list, called when the dictionaries rule is set
+        :param strength: StrengthEstimator, used when the min_guesses rule is set
+        """
+        def setter(name, value):
+            object.__setattr__(self, name, value)
+
+        setter('min_password_length', rules['min_password_length'])
+        setter('long_password_length', rules['long_password_override'] * rules['min_password_length']
+               if rules['long_password_override'] > 1 else None)
+        setter('uppercase', rules['uppercase'])
+        setter('lowercase', rules['lowercase'])
+        setter('numbers', rules['numbers'])
+        setter('punctuation', rules['punctuation'])
+        setter('username', bool(rules['username']))
+        setter('normalize', bool(rules['normalize']))
+        descending = rules['descending_sequences']
+        setter('number_sequences', SequenceScanner(['digits'], rules['number_sequence_length'], descending)
+               if rules['number_sequence'] else None)
+        setter('alphabet_sequences', SequenceScanner(['alphabet'], rules['alphabet_sequence_length'], descending)
+               if rules['alphabet_sequence'] else None)
+        setter('keyboard_sequences', SequenceScanner(rules['keyboard_layouts'], rules['keyboard_sequence_length'],
+                                                     descending) if rules['keyboard_sequence'] else None)
+        setter('common_passwords', common_passwords if rules['passwords'] else None)
+        setter('dictionaries', dictionaries if rules['dictionaries'] else None)
+        setter('min_guesses', rules['min_guesses'])
+        setter('strength', strength if rules['min_guesses'] else None)
+        # (rule, check) of the rules that are on, in the order they are applied
+        checks = [('characters', self.check_characters)]
+        if self.username:
+            checks.append(('username', self.check_username))
+        if self.number_sequences is not None:
+            checks.append(('number_sequence', self.check_number_sequence))
+        if self.alphabet_sequences is not None:
+            checks.append(('alphabet_sequence', self.check_alphabet_sequence))
+        if self.keyboard_sequences is not None:
+            checks.append(('keyboard_sequence', self.check_keyboard_sequence))
+        if self.common_passwords is not None:
+            checks.append(('passwords', self.check_common_passwords))
+        if self.dictionaries is not None:
+            checks.append(('dictionaries', self.check_dictionaries))
+        setter('checks', tuple(checks))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('PasswordValidator is immutable')
+
+    def long_password(self, password):
+        return self.long_password_length is not None and len(password) > self.long_password_length
+
+    def check_characters(self, password, folded, plain, username):
+        failures = self.character_failures(password)
+        return failures[0] if failures else None
+
+    def character_failures(self, password):
+        """
+        :return: list of (rule, message) of every character class rule the password fails
+        """
+        uppercase, lowercase, numbers, punctuation = count_character_classes(password)
+        failures = []
+        if uppercase < self.uppercase:
+            failures.append(('uppercase', '{} uppercase required'.format(self.uppercase)))
+
+        if self.lowercase > 0 and lowercase == 0:
+            failures.append(('lowercase', '{} lowercase required'.format(self.lowercase)))
+
+        if numbers < self.numbers:
+            failures.append(('numbers', '{} number{} required'.format(self.numbers, plural(self.numbers))))
+
+        if punctuation < self.punctuation:
+            failures.append(('punctuation', '{} punctuation{} required'.format(self.punctuation,
+                                                                               plural(self.punctuation))))
+        return failures
+
+    def check_username(self, password, folded, plain, username):
+        if len(username) > 0 and username in plain:
+            return 'username', 'insufficient difference from username'
+        return None
+
+    def check_number_sequence(self, password, folded, plain, username):
+        sequence = self.number_sequences.find(folded)
+        if sequence:
+            return 'number_sequence', 'not enough number complexity, {} disallowed'.format(sequence)
+        return None
+
+    def check_alphabet_sequence(self, password, folded, plain, username):
+        sequence = self.alphabet_sequences.find(plain)
+        if sequence:
+            # found with the substitutions undone, reported as typed
+            start = plain.find(sequence)
+            sequence = folded[start:start + len(sequence)]
+            return 'alphabet_sequence', 'insufficient letter complexity, {} disallowed'.format(sequence)
+        return None
+
+    def check_keyboard_sequence(self, password, folded, plain, username):
+        sequence = self.keyboard_sequences.find(folded)
+        if sequence:
+            return 'keyboard_sequence', 'keyboard sequence found, {} disallowed'.format(sequence)
+        return None
+
+    def check_common_passwords(self, password, folded, plain, username):
+        matcher = self.common_passwords()
+        known_password = matcher.find(password)
+        if known_password is None and self.normalize and plain != password:
+            known_password = matcher.find(plain)
+        if known_password is not None:
+            return 'passwords', 'too similar to common password: {}'.format(known_password)
+        return None
+
+    def check_dictionaries(self, password, folded, plain, username):
+        for dictionary in self.dictionaries():
+            word = dictionary.find(password)
+            if word is None and self.normalize and plain != password:
+                word = dictionary.find(plain)
+            if word is not None:
+                return 'dictionaries', 'too similar to banned password: {}'.format(word)
+        return None
+
+    def normal_forms(self, password):
+        """
+        :return: (folded, plain) forms the rules compare, lower case only when the normalize rule is off
+        """
+        if self.normalize:
+            return normalize(password)
+        lower_password = password.lower()
+        return lower_password, lower_password
+
+    def validate(self, password, username='', collect_all=False, metrics=None):
+        """
+        apply every rule except pwned
+        :param password:
+        :param username: username to valid_password if used in password
+        :param collect_all: apply every rule and report all failures, otherwise stop at the first
+        :param metrics: optional Metrics to record the time taken by each rule and rejections
+        :return: ValidationResult
+        """
+        failures = []
+        if len(password) < self.min_password_length:
+            failures.append(('min_password_length',
+                             'insufficient length.  Required {}'.format(self.min_password_length)))
+            if metrics is not None:
+                metrics.reject('min_password_length')
+            if not collect_all:
+                return ValidationResult(0, failures)
+
+        if self.long_password(password):
+            return ValidationResult(5, failures)
+
+        # only apply these tests if password is of 'middling length'
+        folded, plain = self.normal_forms(password)
+        username = self.normal_forms(username)[1] if username else ''
+        for rule, check in self.checks:
+            if metrics is None:
+                failure = check(password, folded, plain, username)
+            else:
+                start = time.perf_counter()
+                failure = check(password, folded, plain, username)
+                metrics.observe(rule, time.perf_counter() - start)
+            if failure:
+                if metrics is not None:
+                    metrics.reject(failure[0])
+                if not collect_all:
+                    return ValidationResult(0, [failure])
+                if rule == 'characters':
+                    failures.extend(self.character_failures(password))
+                else:
+                    failures.append(failure)
+
+        score = 5
+        if self.strength is not None:
+            start = time.perf_counter()
+            estimate = self.strength.estimate(password, [username] if username else ())
+            if metrics is not None:
+                metrics.observe('min_guesses', time.perf_counter() - start)
+            score = estimate.score + 1
+            if estimate.guesses < self.min_guesses:
+                if metrics is not None:
+                    metrics.reject('min_guesses')
+                failures.append(('min_guesses', 'too easy to guess, about {:.0e} guesses'.format(estimate.guesses)))
+        return ValidationResult(0 if failures else score, failures)
@@ -44,13 +44,13 @@ setup(
         'License :: OSI Approved :: Apache Software License',
 
         'Programming Language :: Python',
-        'Programming Language :: Python :: 2',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3 :: Only',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12',
 
         'Operating System :: POSIX',
         'Operating System :: MacOS',
@@ -61,5 +61,7 @@ setup(
 
     packages=['flask_change_password'],
     include_package_data=True,
+    python_requires='>=3.8',
     install_requires=['flask>=0.11', 'flask-wtf', 'WTForms', 'requests'],
+    extras_require={'async': ['httpx', 'asgiref'], 'live': ['flask-sock']},
 )